@@ -0,0 +1,203 @@
+import csv
+import io
+import json
+from store import ConflictError
+
+# rows are word, type, translations, tags, description, as csv columns or json lines keys
+# translations and tags are lists in json, comma separated like in the edit form in csv
+FIELDS = ('word', 'type', 'translations', 'tags', 'description')
+TYPES = ('simple noun', 'color', 'class', 'pronoun', 'numeral', 'state', 'special')
+ON_EXISTING = ('skip', 'update', 'error') # what to do with rows of words already in the dictionary
+MAX_ERRORS = 100 # reported, the whole file is still checked
+
+
+class RowError(ValueError):
+    def __init__(self, line, message):
+        super().__init__('line %d: %s' % (line, message))
+        self.line = line
+        self.message = message
+
+
+def read_csv(f):
+    """ (line, row) of a csv file with a header naming the columns """
+    reader = csv.DictReader(f)
+    unknown = [name for name in reader.fieldnames or [] if name not in FIELDS]
+    if unknown:
+        raise RowError(1, 'unknown columns %s' % ', '.join(unknown))
+    for row in reader:
+        yield reader.line_num, row
+
+
+def read_jsonl(f):
+    """ (line, row) of a file with a json object per line """
+    for line, text in enumerate(f, 1):
+        if not text.strip():
+            continue
+        try:
+            row = json.loads(text)
+        except ValueError as e:
+            raise RowError(line, 'invalid json, %s' % e)
+        if not isinstance(row, dict):
+            raise RowError(line, 'not an object')
+        yield line, row
+
+
+def read_rows(f, format):
+    if format == 'csv':
+        return read_csv(f)
+    if format == 'jsonl':
+        return read_jsonl(f)
+    raise ValueError("Unknown format `%s`" % format)
+
+
+def guess_format(name):
+    """ from a file name, None if it does not tell """
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    return None
+
+
+def _list(value, field):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = value.split(',')
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise ValueError('%s must be a list of strings' % field)
+    return [item.strip() for item in value if item.strip() != '']
+
+
+def to_entry(row):
+    """ word and attributes of a row, the word is '' if the row has none. Raises ValueError """
+    unknown = [key for key in row if key not in FIELDS]
+    if unknown:
+        raise ValueError('unknown fields %s' % ', '.join(unknown))
+    word = row.get('word') or ''
+    type = row.get('type') or 'simple noun'
+    description = row.get('description') or ''
+    if not isinstance(word, str) or not isinstance(type, str) or not isinstance(description, str):
+        raise ValueError('word, type and description must be strings')
+    type = type.strip().lower()
+    if type not in TYPES:
+        raise ValueError('unknown type `%s`' % type)
+    return ' '.join(word.split()), { # components are the words split on spaces
+        'description': description.strip(),
+        'tags': _list(row.get('tags'), 'tags'),
+        'translations': _list(row.get('translations'), 'translations'),
+        'type': type
+    }
+
+
+def plan(data, rows, on_existing='skip'):
+    """ ops adding the rows to data, checked and deduplicated in one pass over the rows.
+        Rows without a word are given temporary ids later, they hold None meanwhile.
+        Returns the ops and a report of what was left out.
+    """
+    if on_existing not in ON_EXISTING:
+        raise ValueError("Unknown on_existing `%s`" % on_existing)
+    ops = []
+    seen = {} # word -> line and attributes of its first row
+    report = {'rows': 0, 'added': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0, 'duplicates': 0,
+            'errors': [], 'error_count': 0}
+
+    for line, row in rows:
+        report['rows'] += 1
+        try:
+            word, attrs = to_entry(row)
+        except ValueError as e:
+            _error(report, line, str(e))
+            continue
+
+        if word == '':
+            ops.append({'op': 'add', 'word': None, 'attrs': attrs})
+            report['added'] += 1
+            continue
+        if word in seen:
+            report['duplicates'] += 1 # the first one wins
+            if seen[word][1] != attrs:
+                _error(report, line, '`%s` is already on line %d with other attributes' % (word, seen[word][0]))
+            continue
+        seen[word] = (line, attrs)
+
+        if word not in data:
+            ops.append({'op': 'add', 'word': word, 'attrs': attrs})
+            report['added'] += 1
+        elif data[word] == attrs:
+            report['unchanged'] += 1
+        elif on_existing == 'update':
+            ops.append({'op': 'update', 'word': word, 'attrs': attrs})
+            report['updated'] += 1
+        elif on_existing == 'skip':
+            report['skipped'] += 1
+        else:
+            _error(report, line, '`%s` is already in the dictionary' % word)
+    return ops, report
+
+
+def _error(report, line, message):
+    if len(report['errors']) < MAX_ERRORS:
+        report['errors'].append({'line': line, 'error': message})
+    report['error_count'] += 1
+
+
+def import_rows(store, rows, on_existing='skip', dry_run=False):
+    """ adds the rows to the store as a single transaction, nothing if one of them is invalid.
+        Returns a report of the rows, with the new store version once applied.
+    """
+    with store.lock:
+        store.refresh()
+        ops, report = plan(store.data, rows, on_existing)
+        if report['error_count'] or dry_run or not ops:
+            report['applied'] = False
+            return report
+
+        unnamed = [op for op in ops if op['word'] is None]
+        for op, word in zip(unnamed, store.new_temporary_ids(len(unnamed))):
+            op['word'] = word
+        store.apply_batch(ops)
+        report['applied'] = True
+        report['version'] = store.version
+        return report
+
+
+def import_file(store, f, format, on_existing='skip', dry_run=False):
+    """ f is a text file, csv files are best opened with newline='' """
+    return import_rows(store, read_rows(f, format), on_existing, dry_run)
+
+
+def import_stream(store, stream, format, on_existing='skip', dry_run=False):
+    """ same as import_file for a binary stream, an upload for instance """
+    f = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='') # spreadsheets start csv files with a BOM
+    return import_file(store, f, format, on_existing, dry_run)
+
+
+if __name__ == '__main__':
+    import os
+    import time
+    from sys import argv
+    from store import get_store
+    # python bulk_import.py words.csv [--update] [--dry-run]
+    # imports into NYO_STORE (nyo.json by default), while the interface is stopped or shares it with NYO_SHARED
+    paths = [arg for arg in argv[1:] if not arg.startswith('--')]
+    if len(paths) != 1 or guess_format(paths[0]) is None:
+        print('usage: python bulk_import.py <file.csv|file.jsonl> [--update] [--dry-run]')
+    else:
+        start = time.perf_counter()
+        store = get_store(os.environ.get('NYO_STORE', 'nyo.json'))
+        with open(paths[0], 'r', encoding='utf-8-sig', newline='') as f:
+            try:
+                report = import_file(store, f, guess_format(paths[0]), 'update' if '--update' in argv else 'skip', '--dry-run' in argv)
+            except (RowError, ConflictError) as e:
+                print(e)
+                raise SystemExit(1)
+        store.close()
+        for error in report['errors']:
+            print('line %d: %s' % (error['line'], error['error']))
+        print('%d rows, %d added, %d updated, %d unchanged, %d skipped, %d duplicates, %d errors, %s in %.2f s' % (
+                report['rows'], report['added'], report['updated'], report['unchanged'], report['skipped'],
+                report['duplicates'], report['error_count'], 'applied' if report['applied'] else 'nothing applied',
+                time.perf_counter() - start))
+        if report['error_count']:
+            raise SystemExit(1)
@@ -0,0 +1,138 @@
+TYPE_NODES = ['numeral', 'pronoun', 'state', 'special'] # nodes grouping words of these types
+
+# edge kinds, turned into styles by each graph builder
+# 'type' : word -> its type node
+# 'color_component' : color word -> simple noun it is a component of
+# 'component' : any other word -> simple noun it is a component of
+# 'translation' : words sharing a translation
+# 'tag' : words sharing a tag
+
+
+def _tags(attrs):
+    return [t for t in attrs['tags'] if t != "" and t != "p"]
+
+def _translations(attrs):
+    return [t for t in attrs['translations'] if t != ""]
+
+
+class EdgeIndex:
+    """ translation -> words, tag -> words and component -> words indexes over the dictionary.
+
+        Edges are the same as the ones of the old pairwise scan, in the same order,
+        but only the words sharing something with a word are ever looked at.
+    """
+
+    def __init__(self, data=None):
+        self.data = {}
+        self.position = {} # word -> insertion rank, replaces the used_up list
+        self.translations = {} # translation -> set of words
+        self.tags = {} # tag -> set of words
+        self.components = {} # component -> set of simple nouns containing it
+        self.counter = 0
+        if data is not None:
+            for word, attrs in data.items():
+                self.add(word, attrs)
+
+    def add(self, word, attrs):
+        """ adds a word, or replaces its attributes keeping its position like a dict would """
+        if word in self.data:
+            position = self.position[word]
+            self.remove(word)
+        else:
+            position = self.counter
+            self.counter += 1
+        self.data[word] = attrs
+        self.position[word] = position
+        for t in _translations(attrs):
+            self.translations.setdefault(t, set()).add(word)
+        for t in _tags(attrs):
+            self.tags.setdefault(t, set()).add(word)
+        if attrs['type'] == 'simple noun':
+            for c in word.split():
+                self.components.setdefault(c, set()).add(word)
+
+    def remove(self, word):
+        attrs = self.data.pop(word)
+        del self.position[word]
+        for index, keys in [(self.translations, _translations(attrs)), (self.tags, _tags(attrs))]:
+            for key in keys:
+                index[key].discard(word)
+                if not index[key]:
+                    del index[key]
+        if attrs['type'] == 'simple noun':
+            for c in set(word.split()):
+                self.components[c].discard(word)
+                if not self.components[c]:
+                    del self.components[c]
+
+    def _sharing(self, word):
+        """ words sharing a translation or a tag with word """
+        attrs = self.data[word]
+        others = set()
+        for t in _translations(attrs):
+            others |= self.translations[t]
+        for t in _tags(attrs):
+            others |= self.tags[t]
+        return others
+
+    def _edges_from(self, word, other):
+        """ edges set while looking at other from word, as the pairwise scan did """
+        attrs = self.data[word]
+        other_attrs = self.data[other]
+
+        if attrs['type'] != 'simple noun' and other_attrs['type'] == 'simple noun' and word in other.split():
+            if attrs['type'] == 'color':
+                return [(word, other, 'color_component')]
+            return [(word, other, 'component')]
+
+        edges = []
+        if self.position[other] > self.position[word]: # other has not been edged already
+            other_translations = other_attrs['translations']
+            if any(t != "" and t in other_translations for t in attrs['translations']):
+                edges.append((word, other, 'translation'))
+            if any(t != "" and t != "p" and t in other_attrs['tags'] for t in attrs['tags']):
+                edges.append((word, other, 'tag'))
+        return edges
+
+    def _type_edges(self, word):
+        if self.data[word]['type'] in TYPE_NODES:
+            return [(word, self.data[word]['type'], 'type')]
+        return []
+
+    def word_edges(self, word):
+        """ edges set while iterating on word, in order """
+        others = self._sharing(word)
+        if self.data[word]['type'] != 'simple noun':
+            others |= self.components.get(word, set())
+        others.discard(word)
+
+        edges = self._type_edges(word)
+        for other in sorted(others, key=self.position.__getitem__):
+            edges += self._edges_from(word, other)
+        return edges
+
+    def edges_of(self, word):
+        """ every edge touching word """
+        others = self._sharing(word)
+        if self.data[word]['type'] != 'simple noun':
+            others |= self.components.get(word, set())
+        else:
+            others |= set(c for c in word.split() if c in self.data)
+        others.discard(word)
+
+        edges = self._type_edges(word)
+        for other in sorted(others, key=self.position.__getitem__):
+            edges += self._edges_from(word, other)
+            edges += self._edges_from(other, word)
+        return edges
+
+    def edges(self):
+        """ every edge of the graph, in the order of the pairwise scan """
+        edges = []
+        for word in sorted(self.data, key=self.position.__getitem__):
+            edges += self.word_edges(word)
+        return edges
+
+
+def get_edges(data): # data is the json file
+    return EdgeIndex(data).edges()
@@ -0,0 +1,69 @@
+import os
+import threading
+
+
+def atomic_write(path, text):
+    """ writes text to path through a fsync'd temporary file renamed over it,
+        readers see either the old or the new content, never a partial one.
+        text may also be an iterable of strings, written as they come
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    tmp = os.path.join(directory, '.%s.%d.%d.tmp' % (os.path.basename(path), os.getpid(), threading.get_ident()))
+    try:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            if isinstance(text, str):
+                f.write(text)
+            else:
+                f.writelines(text)
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException: # nothing half written is left behind
+        os.remove(tmp)
+        raise
+    os.replace(tmp, path)
+    try: # the rename itself is durable once the directory is synced
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError: # not possible on every platform
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class FileLock:
+    """ exclusive lock on path + '.lock' shared by every process, also usable across threads of one process """
+
+    def __init__(self, path):
+        self.path = path + '.lock'
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            self._file = open(self.path, 'a+')
+            if os.name == 'nt':
+                import msvcrt
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0:
+            if os.name == 'nt':
+                import msvcrt
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        self._thread_lock.release()
@@ -1,68 +1,149 @@
-data = {
-    "fruit": [
-            {"label": "apple", "words": [{"code":"123", "label":"pie"}, {"code":"456", "label":"food"}]},
-            {"label": "strawberry", "words": [{"code":"225", "label":"cake"}, {"code":"865", "label":"sugar"}]}
-        ]
-    }
-
 import json
-with open("groups.json", "r") as f:
-    data = json.load(f)
-
-# write a script that generates a html file with square boxes for each class
-# the associated label should be displayed over each box
-# and each word should be listed inside the box as an empty link
-# align the boxes in a grid so they take the width of the screen (height is unlimited, scrolling is enabled)
-
-with open('output.html', 'w') as f:
-    f.write('<html>\n')
-
-    f.write('<head>\n')
-    f.write('<style>\n')
-    f.write('h2 { text-align: center; font-family: "Helvetica Neue", Helvetica, Arial, sans-serif; }\n')
-    f.write('body { font-family: "Helvetica Neue", Helvetica, Arial, sans-serif; }\n')
-    f.write('.outline { border: 1px solid black; padding: 0.5em; text-align: center; }\n')
-    f.write('.outline-orange { background-color: orange; }\n')
-    f.write('.outline-purple { background-color: #e6e6fa; }\n')
-    f.write('.container { width: 18%; float: left; margin: 0.5%; }\n')
-    f.write('p { margin: 0.5em; font-size: 1.5em; }\n')
-    f.write('a { text-decoration: none; }\n')
-    f.write('a:hover { text-decoration: none; position: relative; }\n')
-    f.write('a:hover .box { display: block; position: absolute; left: 0; top: 0; width: 100%; height: 100%; background-color: #e6e6fa; }\n')
-    f.write('.box { display: none; }\n')
-    f.write('</style>\n')
-    f.write('</head>\n')
-
-    f.write('<body>\n')
-
-    for entry in data['entries']:
-        f.write('<a href="">\n')
-        f.write('<div class="container">\n')
-
-        if entry['type'] == 'class':
-            f.write('<h2 style="font-color:orange"')
-        else:
-            f.write('<h2 style="color:purple"')
-
-        f.write('>{}</h2>\n'.format(entry['code']))
-
-        if entry['type'] == 'class':
-            f.write('<div class="outline-orange">\n')
-        else:
-            f.write('<div class="outline-purple">\n')
-        
-        for word in entry["words"]:
-            f.write('<a href=""><p>{}</p></a><br>\n'.format(word["code"])) # display for label... FEATURE
-        f.write('</div>\n')
-
-        f.write('<div class="box">\n')
-        f.write('<p>test</p>\n')
-        f.write('</div>\n')
-
-
-        f.write('</div>\n')
-        f.write('</a>\n')
-
-    f.write('</body>\n')
-
-    f.write('</html>\n')
+from html import escape
+from fileutil import atomic_write
+
+# generates a html file with square boxes for each class
+# the associated label is displayed over each box
+# and each word is listed inside the box as an empty link
+# the boxes are aligned in a grid so they take the width of the screen (height is unlimited, scrolling is enabled)
+
+HEAD = (
+    '<html>\n'
+    '<head>\n'
+    '<style>\n'
+    'h2 { text-align: center; font-family: "Helvetica Neue", Helvetica, Arial, sans-serif; }\n'
+    'body { font-family: "Helvetica Neue", Helvetica, Arial, sans-serif; }\n'
+    '.outline { border: 1px solid black; padding: 0.5em; text-align: center; }\n'
+    '.outline-orange { background-color: orange; }\n'
+    '.outline-purple { background-color: #e6e6fa; }\n'
+    '.container { width: 18%; float: left; margin: 0.5%; }\n'
+    'p { margin: 0.5em; font-size: 1.5em; }\n'
+    'a { text-decoration: none; }\n'
+    'a:hover { text-decoration: none; position: relative; }\n'
+    'a:hover .box { display: block; position: absolute; left: 0; top: 0; width: 100%; height: 100%; background-color: #e6e6fa; }\n'
+    '.box { display: none; }\n'
+    '</style>\n'
+    '</head>\n'
+    '<body>\n'
+)
+
+TAIL = (
+    '</body>\n'
+    '</html>\n'
+)
+
+CHUNK_SIZE = 1 << 16
+NUMBER_CHARS = '0123456789+-.eE' # a number cut by a chunk may go on with these
+
+
+def iter_entries(path='groups.json'):
+    """ yields the items of the 'entries' list of groups.json one at a time,
+        reading the file by chunks so that it is never loaded as a whole
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer = ''
+        pos = 0
+        eof = False
+
+        def fill(): # reads more, dropping what was parsed already
+            nonlocal buffer, pos, eof
+            chunk = f.read(CHUNK_SIZE)
+            if chunk == '':
+                eof = True
+            buffer = buffer[pos:] + chunk
+            pos = 0
+
+        def peek(): # next non blank character
+            nonlocal pos
+            while True:
+                while pos < len(buffer) and buffer[pos].isspace():
+                    pos += 1
+                if pos < len(buffer):
+                    return buffer[pos]
+                if eof:
+                    raise ValueError('%s: unexpected end of file' % path)
+                fill()
+
+        def value(): # next complete json value
+            nonlocal pos
+            peek()
+            while True:
+                try:
+                    item, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    fill()
+                    continue
+                if not eof and not buffer[end:].lstrip(NUMBER_CHARS): # a number may go on in the next chunk, '1.' decodes as 1
+                    fill()
+                    continue
+                pos = end
+                return item
+
+        def expect(char):
+            nonlocal pos
+            if peek() != char:
+                raise ValueError('%s: expected %r at %r' % (path, char, buffer[pos:pos + 20]))
+            pos += 1
+
+        expect('{')
+        while peek() != '}':
+            key = value()
+            expect(':')
+            if key != 'entries':
+                value() # skipping it
+            else:
+                expect('[')
+                while peek() != ']':
+                    yield value()
+                    if peek() == ',':
+                        pos += 1
+                return
+            if peek() == ',':
+                pos += 1
+
+
+def render_entry(entry):
+    """ html of the box of a class or color entry """
+    parts = ['<a href="">\n', '<div class="container">\n']
+
+    if entry['type'] == 'class':
+        parts.append('<h2 style="font-color:orange"')
+    else:
+        parts.append('<h2 style="color:purple"')
+    parts.append('>{}</h2>\n'.format(escape(entry['code'])))
+
+    if entry['type'] == 'class':
+        parts.append('<div class="outline-orange">\n')
+    else:
+        parts.append('<div class="outline-purple">\n')
+
+    for word in entry["words"]:
+        parts.append('<a href=""><p>{}</p></a><br>\n'.format(escape(word["code"]))) # display for label... FEATURE
+    parts.append('</div>\n')
+
+    parts.append('<div class="box">\n')
+    parts.append('<p>test</p>\n')
+    parts.append('</div>\n')
+
+    parts.append('</div>\n')
+    parts.append('</a>\n')
+    return ''.join(parts)
+
+
+def render_fiches(entries):
+    """ generator of the fiches page of the entries, one box at a time, usable as a streaming flask response """
+    yield HEAD
+    for entry in entries:
+        yield render_entry(entry)
+    yield TAIL
+
+
+def write_fiches(path='groups.json', output='output.html'):
+    atomic_write(output, render_fiches(iter_entries(path))) # output may be served meanwhile
+
+
+if __name__ == '__main__':
+    write_fiches()
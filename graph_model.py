@@ -0,0 +1,370 @@
+import json
+import os
+from fileutil import atomic_write
+from edges import EdgeIndex, TYPE_NODES
+from grapher import get_node_attrs, build_graph, build_nx_graph, node_formatter, edge_formatter, GRAPH_ATTRS
+from render_cache import RenderCache, dictionary_key
+
+KIND_ORDER = {'type': 0, 'color_component': 1, 'component': 1, 'translation': 2, 'tag': 3} # order of the edges set from a word
+MAX_DEPTH = 3 # of a neighbourhood, the graph is small world, beyond that it is most of it
+RENDERERS = ('graphviz', 'native')
+NATIVE_SIZE = ('1600px', '1200px')
+
+
+class GraphModel:
+    """ in-process dictionary graph, kept up to date by applying edits as deltas.
+
+        Only the nodes and edges around an edited word are recomputed.
+        The Graphviz layout is only rerun when nodes or edges were added or removed,
+        otherwise the previous positions are pinned and the graph is just redrawn.
+        With a RenderCache, a dictionary state that was already rendered skips Graphviz.
+        Drawing itself is done by render() on a snapshot(), so that it can also run in
+        another process, see render_pool.RenderPool. Native drawings of one layout share
+        their frame, rendered() then returns the patch from the previous one to the new one.
+
+        The native renderer draws with nxsvg.SVGRenderer in process instead, so no
+        subprocess is ever started. Its layout is kept across edits: new words and words
+        whose links changed are placed among the others, which do not move, and the
+        whole graph is only laid out again by relayout(). With a layout_path, positions
+        are saved there by word and reused on the next start.
+    """
+
+    def __init__(self, data, cache=None, renderer='graphviz', layout_path=None): # data is the json file
+        if renderer not in RENDERERS:
+            raise ValueError("Unknown renderer `%s`" % renderer)
+        self.cache = cache
+        self.renderer = renderer
+        self.index = EdgeIndex(data)
+        self.nodes = {word: get_node_attrs(word, attrs) for word, attrs in data.items()}
+        self.incident = {word: set() for word in data} # word -> edges touching it
+        for edge in self.index.edges():
+            self._add_edge(edge)
+
+        self.version = 0
+        self.epoch = 0 # increased when the layout is dropped, positions of an older epoch are not taken back
+        self.positions = None # node (and edge for graphviz) -> pos of the last layout, None if it has to be done again
+        self.moved = {} # words to place in the kept native layout -> version of their last move
+        self.frame = None # bounds and scale the native layout is drawn with, kept until it is dropped
+        self.parts = None # last native drawing by element, see nxsvg.diff_parts
+        self.parts_version = None
+        self.ego_cache = RenderCache(max_entries=64) # neighbourhood svgs by version, depth and word
+        self._svg = None
+
+        self.layout_path = layout_path
+        if renderer == 'native' and layout_path is not None and os.path.exists(layout_path):
+            with open(layout_path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            positions = {node: tuple(saved[node]) for node in list(self.nodes) + TYPE_NODES if node in saved}
+            if positions:
+                self.positions = positions
+                self.moved = dict.fromkeys(set(self.nodes) - set(positions), 0)
+
+    def _add_edge(self, edge):
+        for end in edge[:2]:
+            if end in self.incident:
+                self.incident[end].add(edge)
+
+    def _remove_edge(self, edge):
+        for end in edge[:2]:
+            if end in self.incident:
+                self.incident[end].discard(edge)
+
+    def _edge_order(self, edge):
+        position = self.index.position
+        return position[edge[0]], KIND_ORDER[edge[2]] != 0, position.get(edge[1], -1), KIND_ORDER[edge[2]]
+
+    def edges(self):
+        """ every edge, in the order of a full rebuild """
+        edges = set()
+        for incident in self.incident.values():
+            edges |= incident
+        return sorted(edges, key=self._edge_order)
+
+    def neighbourhood(self, word, depth=1):
+        """ nodes and edges of the words at most depth links away from word.
+            Type nodes end paths, every word of a type would be two links away otherwise.
+        """
+        seen = set([word])
+        frontier = [word]
+        for i in range(min(depth, MAX_DEPTH)):
+            reached = []
+            for node in frontier:
+                for edge in self.incident[node]:
+                    for end in edge[:2]:
+                        if end not in seen and end in self.incident:
+                            seen.add(end)
+                            reached.append(end)
+            frontier = reached
+
+        edges = set()
+        for node in seen:
+            for edge in self.incident[node]:
+                if (edge[0] in seen or edge[0] in TYPE_NODES) and (edge[1] in seen or edge[1] in TYPE_NODES):
+                    edges.add(edge)
+        return {node: self.nodes[node] for node in seen}, sorted(edges, key=self._edge_order)
+
+    # DELTAS
+    # each returns a dict of what changed, topology changes drop the layout
+
+    def _changed(self, delta):
+        self.version += 1
+        self._svg = None
+        if delta['nodes_added'] or delta['nodes_removed'] or delta['edges_added'] or delta['edges_removed']:
+            if self.renderer == 'native' and self.positions is not None: # placing the moved words will do
+                for word in delta['nodes_removed']:
+                    self.positions.pop(word, None)
+                    self.moved.pop(word, None)
+            else:
+                self.positions = None
+                self.moved = {}
+                self.frame = None
+                self.epoch += 1
+        delta['layout'] = self.positions is None or len(self.moved) > 0
+        delta['version'] = self.version
+        return delta
+
+    def _empty_delta(self):
+        return {'nodes_added': [], 'nodes_removed': [], 'nodes_changed': [], 'edges_added': [], 'edges_removed': []}
+
+    def _set(self, word, attrs, delta):
+        if word in self.nodes:
+            old_edges = set(self.incident[word])
+        else:
+            old_edges = set()
+            self.incident[word] = set()
+            delta['nodes_added'].append(word)
+
+        self.index.add(word, attrs)
+        node = get_node_attrs(word, attrs)
+        if word not in delta['nodes_added'] and node != self.nodes[word]:
+            delta['nodes_changed'].append(word)
+        self.nodes[word] = node
+
+        new_edges = set(self.index.edges_of(word))
+        for edge in old_edges - new_edges:
+            self._remove_edge(edge)
+            delta['edges_removed'].append(edge)
+        for edge in new_edges - old_edges:
+            self._add_edge(edge)
+            delta['edges_added'].append(edge)
+        if new_edges != old_edges or word in delta['nodes_added']:
+            self.moved[word] = self.version + 1
+
+    def _delete(self, word, delta):
+        for edge in list(self.incident[word]):
+            self._remove_edge(edge)
+            delta['edges_removed'].append(edge)
+        del self.incident[word]
+        del self.nodes[word]
+        self.index.remove(word)
+        delta['nodes_removed'].append(word)
+
+    def set(self, word, attrs):
+        """ adds a word or edits its attributes """
+        delta = self._empty_delta()
+        self._set(word, attrs, delta)
+        return self._changed(delta)
+
+    def delete(self, word):
+        delta = self._empty_delta()
+        self._delete(word, delta)
+        return self._changed(delta)
+
+    def rename(self, word, new_word, attrs):
+        """ same as data[new_word] = attrs then data.pop(word) """
+        delta = self._empty_delta()
+        self._set(new_word, attrs, delta)
+        self._delete(word, delta)
+        return self._changed(delta)
+
+    def apply(self, op):
+        """ applies a store edit, see store.apply_op """
+        if op['op'] == 'add' or op['op'] == 'update':
+            return self.set(op['word'], op['attrs'])
+        if op['op'] == 'rename':
+            if op['word'] == op['new_word']:
+                return self.set(op['new_word'], op['attrs'])
+            return self.rename(op['word'], op['new_word'], op['attrs'])
+        if op['op'] == 'delete':
+            return self.delete(op['word'])
+        raise ValueError("Unknown operation `%s`" % op['op'])
+
+    # RENDERING
+
+    def relayout(self):
+        """ lays the whole graph out again on the next render """
+        self.version += 1
+        self.epoch += 1
+        self.positions = None
+        self.moved = {}
+        self.frame = None
+        self._svg = None
+
+    def _cache_key(self):
+        """ key of the current state in the RenderCache, None if it is not cached """
+        # a kept native layout depends on the edit history, not only on the dictionary
+        if self.cache is None or (self.renderer == 'native' and self.positions is not None):
+            return None
+        return dictionary_key(self.index.data, GRAPH_ATTRS if self.renderer == 'graphviz' else {'renderer': self.renderer})
+
+    def cached(self):
+        """ the svg of the current state if it was drawn already, None otherwise """
+        if self._svg is None:
+            key = self._cache_key()
+            if key is not None:
+                self._svg = self.cache.get(key)
+        return self._svg
+
+    def snapshot(self):
+        """ everything render() needs to draw the current state, detached from the model """
+        return {
+            'renderer': self.renderer,
+            'version': self.version,
+            'epoch': self.epoch,
+            'key': self._cache_key(),
+            'nodes': dict(self.nodes),
+            'edges': self.edges(),
+            'positions': None if self.positions is None else dict(self.positions),
+            'moved': sorted(self.moved),
+            'frame': self.frame,
+        }
+
+    def rendered(self, job, result):
+        """ takes back what render(job) returned, the model may have been edited meanwhile.
+            Returns the svg and the patch from the previous native drawing to it, None if there is none.
+        """
+        from nxsvg import iter_parts, diff_parts
+
+        patch = None
+        if 'parts' in result:
+            svg = ''.join(iter_parts(result['parts']))
+            if self.parts is not None:
+                patch = diff_parts(self.parts, result['parts'])
+            if patch is not None:
+                patch.update(since=self.parts_version, version=job['version'])
+            self.parts, self.parts_version = result['parts'], job['version']
+        else:
+            svg = result['svg']
+
+        if job['key'] is not None:
+            self.cache.put(job['key'], svg)
+        if job['version'] == self.version:
+            self._svg = svg
+
+        if job['epoch'] != self.epoch: # layout dropped since the snapshot
+            return svg, patch
+        if self.renderer == 'graphviz':
+            self.positions = result['positions']
+            return svg, patch
+        laid_out = job['positions'] is None or len(job['moved']) > 0
+        self.positions = {node: p for node, p in result['positions'].items() if node in self.nodes or node in TYPE_NODES}
+        self.moved = {word: version for word, version in self.moved.items() if version > job['version']} # moved again since
+        self.frame = result['frame']
+        if laid_out and self.layout_path is not None:
+            atomic_write(self.layout_path, json.dumps(self.positions, ensure_ascii=False))
+        return svg, patch
+
+    def ego_snapshot(self, word, depth=1):
+        """ everything render_ego() needs to draw the neighbourhood of word, with its svg if it
+            was drawn already. KeyError if word is unknown, ValueError if depth is negative
+        """
+        if depth < 0:
+            raise ValueError("Negative depth %d" % depth)
+        depth = min(depth, MAX_DEPTH) # deeper ones are the same graph, cached once
+        job = {'key': '%d:%d:%s' % (self.version, depth, word), 'renderer': self.renderer}
+        job['svg'] = self.ego_cache.get(job['key'])
+        if job['svg'] is None:
+            job['nodes'], job['edges'] = self.neighbourhood(word, depth)
+        return job
+
+    def ego_rendered(self, job, svg):
+        """ takes back what render_ego(job) drew """
+        self.ego_cache.put(job['key'], svg)
+
+    def ego_svg(self, word, depth=1):
+        """ the svg of the neighbourhood of word, laid out on its own, KeyError if word is unknown """
+        job = self.ego_snapshot(word, depth)
+        if job['svg'] is None:
+            job['svg'] = render_ego(job)
+            self.ego_rendered(job, job['svg'])
+        return job['svg']
+
+    def svg(self):
+        """ the svg of the current graph, laid out again only if the topology changed """
+        if self.cached() is None:
+            job = self.snapshot()
+            self.rendered(job, render(job))
+        return self._svg
+
+
+def _layout(graph, edges):
+    """ runs the Graphviz layout once and returns node and edge positions """
+    layout = json.loads(graph.create(format='json').decode('utf-8'))
+    objects = layout.get('objects', [])
+    positions = {obj['name']: obj['pos'] for obj in objects if 'pos' in obj}
+    for edge, obj in zip(edges, layout.get('edges', [])):
+        if 'pos' in obj:
+            positions[edge] = obj['pos']
+    return positions
+
+
+def _native_svg(nodes, edges, positions, moved, frame):
+    """ draws the graph with nxsvg by element, the layout is only computed again if the topology changed """
+    from nxsvg import SVGRenderer, hierarchy_layout, relax_layout
+
+    graph = build_nx_graph(nodes, edges)
+    if positions is None:
+        positions = hierarchy_layout(graph, seed=0)
+    elif moved:
+        positions = relax_layout(graph, positions, moved, seed=0)
+    positions = {node: (float(p[0]), float(p[1])) for node, p in positions.items()}
+    if frame is None: # a new layout, later drawings keep its frame so that they can be patched
+        xy = [positions[node] for node in graph]
+        bounds = [min(x for x, y in xy), min(y for x, y in xy)], [max(x for x, y in xy), max(y for x, y in xy)]
+        frame = {'bounds': bounds, 'scale': len(graph) ** 0.6 * 300.} # same proportions as nxsvg's notebook repr
+    renderer = SVGRenderer(GlobalScale=frame['scale'], Margin=frame['scale'] * 0.05, StableIds=True)
+    parts = renderer.draw(graph, positions, size=NATIVE_SIZE, bounds=frame['bounds'],
+            nodeformatter=node_formatter, edgeformatter=edge_formatter, id='svg-graph', backend='parts')
+    return {'parts': parts, 'positions': positions, 'frame': frame}
+
+
+def _graphviz_svg(nodes, edges, positions):
+    if positions is None:
+        positions = _layout(build_graph(nodes, edges), edges)
+
+    # pinned positions, neato -n2 only draws
+    pinned = {}
+    for word, node_attrs in nodes.items():
+        pinned[word] = dict(node_attrs, pos=positions[word] + '!')
+    graph = build_graph(pinned, edges, layout='neato', overlap='true')
+    for node in TYPE_NODES:
+        graph.get_node(node)[0].set('pos', positions[node] + '!')
+    for edge, pydot_edge in zip(edges, graph.get_edges()):
+        if edge in positions:
+            pydot_edge.set('pos', positions[edge])
+
+    return {'svg': graph.create(prog=['neato', '-n2'], format='svg').decode('utf-8'), 'positions': positions}
+
+
+def render_ego(job):
+    """ draws a GraphModel.ego_snapshot(), only depends on its argument so it needs no lock """
+    if job['renderer'] == 'graphviz':
+        return build_graph(job['nodes'], job['edges']).create(format='svg').decode('utf-8')
+
+    from nxsvg import SVGRenderer, hierarchy_layout
+
+    graph = build_nx_graph(job['nodes'], job['edges'])
+    graph.remove_nodes_from([node for node in TYPE_NODES if graph.degree(node) == 0])
+    scale = len(graph) ** 0.6 * 300.
+    renderer = SVGRenderer(GlobalScale=scale, Margin=scale * 0.05)
+    return renderer.draw(graph, hierarchy_layout(graph, seed=0), size=NATIVE_SIZE,
+            nodeformatter=node_formatter, edgeformatter=edge_formatter, id='svg-graph', backend='string')
+
+
+def render(job):
+    """ draws a GraphModel.snapshot(), returns the svg, or its parts for the native renderer,
+        and the positions of its layout. Only depends on its argument, so it can run in a worker process.
+    """
+    if job['renderer'] == 'native':
+        return _native_svg(job['nodes'], job['edges'], job['positions'], job['moved'], job['frame'])
+    return _graphviz_svg(job['nodes'], job['edges'], job['positions'])
@@ -0,0 +1,74 @@
+from collections import Counter
+from nxsvg import markup, _escape_cdata
+from quadtree import QuadTree
+
+MAX_NODES = 400 # elements of a view whatever the size of the dictionary, the most linked nodes first
+MAX_EDGES = 1200
+FONT_SIZE = 20. # of the labels in the drawing, nxsvg's default, in its units
+DETAIL_FONT = 7. # smallest font size in pixels whole labels are shown at, only the words below
+WORD_FONT = 12. # font size in pixels of the words
+
+
+class GraphView:
+    """ a native drawing (GraphModel.parts) indexed by position, to send a page only what it shows.
+
+        Made once per drawing, then every svg() only looks at the elements in its rectangle.
+    """
+
+    def __init__(self, parts, version):
+        self.version = version
+        self.viewbox = parts['viewbox']
+        x, y, w, h = self.viewbox
+        self.defs = ''.join(parts['defs'].values())
+        self.nodes = QuadTree((x, y, x + w, y + h))
+        self.edges = QuadTree((x, y, x + w, y + h))
+
+        boxes = parts['boxes']
+        ends = parts['ends']
+        degree = Counter()
+        for u, v in ends.values():
+            degree[u] += 1
+            degree[v] += 1
+        for id, fragment in parts['nodes']:
+            self.nodes.insert(boxes[id], (-degree[id], id, fragment, boxes[id]))
+        labels = dict(parts['labels'])
+        for id, fragment in parts['edges']:
+            self.edges.insert(boxes[id], (id, fragment + labels.get(id + ':label', ''), ends[id]))
+
+    def fit_scale(self, rect, width, height):
+        """ pixels per unit of rect, the whole drawing if None, shown in width x height pixels """
+        x, y, w, h = rect if rect is not None else self.viewbox
+        return min(width / w, height / h)
+
+    def svg(self, rect=None, scale=None):
+        """ svg of what is in rect (x, y, width, height) of the drawing, the whole of it by default,
+            seen at scale pixels per unit. Zoomed out, or when the scale is unknown, nodes are only their word.
+        """
+        if rect is None:
+            rect = self.viewbox
+        x, y, w, h = rect
+        box = (x, y, x + w, y + h)
+
+        nodes = sorted(self.nodes.query(box))
+        dropped = set([id for degree, id, fragment, node_box in nodes[MAX_NODES:]])
+        detail = scale is not None and FONT_SIZE * scale >= DETAIL_FONT
+        font_size = WORD_FONT / scale if scale is not None else FONT_SIZE
+        node_layer = []
+        for degree, id, fragment, (x0, y0, x1, y1) in nodes[:MAX_NODES]:
+            if detail:
+                node_layer.append(fragment)
+                continue
+            node_layer.append(markup('g', {'class_': 'node', 'id': id}, markup('text', {
+                    'x': (x0 + x1) * 0.5, 'y': (y0 + y1) * 0.5,
+                    'font_family': 'monospace', 'font_size': font_size,
+                    'text_anchor': 'middle', 'dominant_baseline': 'middle'}, _escape_cdata(id))))
+
+        # edges of the nodes left out go with them
+        edges = sorted([edge for edge in self.edges.query(box) if edge[2][0] not in dropped and edge[2][1] not in dropped])
+        edge_layer = [fragment for id, fragment, ends in edges[:MAX_EDGES]]
+
+        return markup('svg', {
+                'id': 'svg-graph', 'viewBox': ','.join([str(value) for value in rect]),
+                'preserveAspectRatio': 'xMidYMid meet',
+                'xmlns': 'http://www.w3.org/2000/svg'},
+                markup('defs', {}, self.defs) + '<g>' + ''.join(node_layer) + '</g>' + markup('g', {}, ''.join(edge_layer)))
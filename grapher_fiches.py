@@ -1,131 +1,211 @@
 import json
-import pydot # try using networkX instead
-
-def get_label(word, attrs):
-    if 'p' in attrs['tags']:
-        label = '/' + word # using word as label
-    else:
-        label = '.' + word
-
-    if attrs['translations'] != []:
-        translation = str(attrs['translations'])[1:-1] # attrs['translations'][0]
-
-        if len(translation.split(' ')) > 4:
-            label += '\n('
-            k = 0
-            sections = translation.split(' ')
-            section = ""
-            while k < len(sections):
-                section += sections[k] + ' '
-                if k % 3 == 2:
-                    if k > 2: # not the first iteration
-                        label += '\n'
-                    label += section
-                    section = ""
-                k += 1
-            if k % 3 != 0: # car k += 1
-                label += '\n' + section
-            label = label[:-1] + ')'
-
-        else:
-            label += '\n(' + translation + ')'
-
-    i = 0
-    desc = attrs['description'].split(' ')
-    m = len(desc)
-    if len(desc) > 1:
-        while i < m:
-            if i % 4 == 0:
-                label += '\n'
-            label += desc[i] + ' '
-            i += 1
-
-    return label
-
-
-def get_graph(data): # data is the json file
-
-    words = []
-    classes = {}
-    colors = {}
-    groups = {} # groups of words to be displayed in a separate table
-
-    for word, attrs in data.items(): # registering base words
-        if attrs['type'] == 'class' or attrs['type'] == 'special' or attrs['type'] == 'pronoun' or attrs['type'] == 'state':
-            classes[word] = {'label': get_label(word, attrs), 'words': []} # creating empty subdict
-        if attrs['type'] == 'color' or attrs['type'] == 'numeral':
-            colors[word] = {'label': get_label(word, attrs), 'words': []} # creating empty subdict
-        else:
-            continue
-
-    for word, attrs in data.items(): # adding nodes
-
-        label = get_label(word, attrs)
-
+import threading
+from fileutil import atomic_write
+from graph_fiches_generator import write_fiches
+from ranking import GroupRanking
+from labels import get_label
+
+CLASS_TYPES = ('class', 'special', 'pronoun', 'state') # words with a class box of their own
+COLOR_TYPES = ('color', 'numeral') # words with a color box of their own
+
+
+def _group_keys(attrs):
+    """ tags and translations a word is grouped by, in order """
+    return [tag for tag in attrs['tags'] if tag != 'p'] + attrs['translations']
+
+
+def _count(index, key, word, delta):
+    members = index.setdefault(key, {})
+    members[word] = members.get(word, 0) + delta
+    if members[word] == 0:
+        del members[word]
+        if not members:
+            del index[key]
+
+
+class FicheIndex:
+    """ classes, colors and groups of words shown by the fiches, kept up to date by applying
+        the store's edits, subscribe apply to the store.
+
+        Compounds go in the class of their last word, simple nouns in the class of each of
+        their words or in its color when it is not a class, and nouns sharing a tag or a
+        translation form a group. A word that only has a class because of compounds is one
+        from its first compound on, in the order of the json file: nouns before it stay in
+        its color. An edit only touches the boxes and groups of the words it changes, and
+        only those are laid out again when groups.json and the fiches page are asked for,
+        see materialize.
+    """
+
+    def __init__(self, data, lock=None): # data is the json file
+        self.lock = lock if lock is not None else threading.RLock() # the lock the store is edited under
+        self.data = {} # word -> attributes it is indexed with
+        self.position = {} # word -> rank in the json file
+        self.counter = 0
+        self.bases = {} # class and color words -> 'class' or 'color'
+        self.nouns = {} # word -> {simple noun having it: times}
+        self.compounds = {} # last word -> {compound: times}
+        self.groups = {} # tag or translation -> {word: times}
+        self.boxes = {} # (type, word) -> entry of groups.json
+        self.ranking = GroupRanking() # boxes by number of words, ties by the rank they were made at in get_graph
+        self.group_lists = {} # tag or translation of several words -> (order, words of groups.json)
+        self.dirty = set() # words whose boxes are to be laid out again
+        self.dirty_groups = set()
+        self.version = 0 # edits applied
+        self.written = None # version groups.json and the fiches page were last written at
+        self.write_lock = threading.Lock()
+        for word, attrs in data.items():
+            self._set(word, attrs)
+
+    def _index(self, word, attrs, delta):
+        if attrs['type'] in CLASS_TYPES:
+            self.bases[word] = 'class'
+            self.dirty.add(word)
+        elif attrs['type'] in COLOR_TYPES:
+            self.bases[word] = 'color'
+            self.dirty.add(word)
         if attrs['type'] == 'simple noun':
-            type = 'noun'
+            for component in word.split(' '):
+                _count(self.nouns, component, word, delta)
+                self.dirty.add(component)
         elif attrs['type'] == 'compound':
-            type = 'compound'
+            _count(self.compounds, word.split(' ')[-1], word, delta)
+            self.dirty.add(word.split(' ')[-1])
+        else: # only nouns are grouped
+            return
+        for key in _group_keys(attrs):
+            _count(self.groups, key, word, delta)
+            self.dirty_groups.add(key)
+
+    def _set(self, word, attrs):
+        if word in self.data: # keeps its place, like a dict would
+            self._index(word, self.data.pop(word), -1)
+            self.bases.pop(word, None)
         else:
-            continue
-    
-        # appending to base classes
+            self.position[word] = self.counter
+            self.counter += 1
+        self.data[word] = attrs
+        self._index(word, attrs, 1)
+
+    def _delete(self, word):
+        if word not in self.data:
+            return
+        self._index(word, self.data.pop(word), -1)
+        self.bases.pop(word, None)
+        del self.position[word]
+
+    def apply(self, op):
+        """ applies a store edit, see store.apply_op """
+        if op['op'] == 'add' or op['op'] == 'update':
+            self._set(op['word'], op['attrs'])
+        elif op['op'] == 'rename':
+            self._set(op['new_word'], op['attrs'])
+            if op['word'] != op['new_word']:
+                self._delete(op['word'])
+        elif op['op'] == 'delete':
+            self._delete(op['word'])
+        else:
+            raise ValueError("Unknown operation `%s`" % op['op'])
+        self.version += 1
+
+    # LAYING OUT
+
+    def _instances(self, members):
+        """ word data of the members, in the order of the json file """
+        instances = []
+        for word in sorted(members, key=self.position.__getitem__):
+            instances += [{'code': word, 'label': get_label(word, self.data[word])}] * members[word]
+        return instances
+
+    def _lay_out_boxes(self, word):
+        """ class and color boxes of word, as going through the json file in order makes them """
+        position = self.position
+        for key in [('class', word), ('color', word)]:
+            if self.boxes.pop(key, None) is not None:
+                self.ranking.remove(key)
+        kind = self.bases.get(word)
+        nouns = self.nouns.get(word, {})
+        compounds = self.compounds.get(word, {})
+
+        # nouns go in the class box once there is one, made by the word or by its first compound
+        if kind == 'class':
+            made = -1
+        elif compounds:
+            made = min(map(position.__getitem__, compounds))
+        else:
+            made = None
+        class_nouns = dict((noun, times) for noun, times in nouns.items() if made is not None and position[noun] > made)
+        color_nouns = dict((noun, times) for noun, times in nouns.items() if noun not in class_nouns)
+
+        if made is not None:
+            rank = (False, 0, position[word], 0) if kind == 'class' else (False, 1, made, 0)
+            members = dict(compounds)
+            members.update(class_nouns)
+            self._box(word, 'class', members, rank)
+        if kind == 'color' or color_nouns:
+            if kind == 'color':
+                rank = (True, 0, position[word], 0)
+            else: # made by its first noun
+                first = min(color_nouns, key=position.__getitem__)
+                rank = (True, 1, position[first], first.split(' ').index(word))
+            self._box(word, 'color', color_nouns, rank)
+
+    def _box(self, word, kind, members, rank):
+        label = get_label(word, self.data[word]) if self.bases.get(word) == kind else "" # boxes made by other words have none
+        self.boxes[(kind, word)] = {'code': word, 'type': kind, 'label': label, 'words': self._instances(members)}
+        self.ranking.add((kind, word), len(self.boxes[(kind, word)]['words']), rank)
+
+    def _lay_out_group(self, key):
+        self.group_lists.pop(key, None)
+        members = self.groups.get(key, {})
+        if sum(members.values()) > 1: # groups of a single word are left out
+            first = min(members, key=self.position.__getitem__)
+            order = (self.position[first], _group_keys(self.data[first]).index(key))
+            self.group_lists[key] = (order, self._instances(members))
+
+    def _lay_out(self):
+        for word in self.dirty:
+            self._lay_out_boxes(word)
+        for key in self.dirty_groups:
+            self._lay_out_group(key)
+        self.dirty = set()
+        self.dirty_groups = set()
+
+    def top(self, k):
+        """ entries of groups.json of the k boxes with the most words, most first """
+        with self.lock:
+            self._lay_out()
+            return [self.boxes[key] for key in self.ranking.top(k)]
+
+    def groups_json(self):
+        """ content of groups.json: boxes by increasing number of words, the last made first among
+            equal ones going through the json file, then the groups of several words
+        """
+        self._lay_out()
+        groups = sorted(self.group_lists.items(), key=lambda item: item[1][0])
+        return {'entries': [self.boxes[key] for key in self.ranking.ordered()],
+                'groups': dict((key, words) for key, (order, words) in groups)}
+
+    def materialize(self, path='groups.json', output='output.html'):
+        """ writes groups.json and the fiches page if the dictionary changed since they last were,
+            returns whether it did
+        """
+        with self.write_lock:
+            with self.lock:
+                if self.version == self.written:
+                    return False
+                version = self.version
+                text = json.dumps(self.groups_json(), indent=4)
+            atomic_write(path, text)
+            write_fiches(path, output)
+            self.written = version
+            return True
 
-        word_instance = {'code': word, 'label': label} # word data to add to the many pages
 
-        if type == 'noun':
-            for component in word.split(' '):
-                if component in classes.keys():
-                    classes[component]['words'].append(word_instance)
-                else:
-                    if component not in colors.keys(): # default behavior : create a new color class
-                        colors[component] = {'label': "", 'words': []} # creating empty dict
-                    colors[component]['words'].append(word_instance)
-
-        elif type == 'compound':
-            class_word = word.split(' ')[-1]
-            
-            if class_word not in classes.keys():
-                classes[class_word] = {'label': "", 'words': []} # creating empty dict
-            classes[class_word]['words'].append(word_instance)
-
-        # adding word group instances
-
-        for tag in attrs['tags']:
-            if tag != 'p':
-                if tag not in groups.keys():
-                    groups[tag] = []
-                groups[tag].append(word_instance)
-            
-        for translation in attrs['translations']:
-            if translation not in groups.keys():
-                groups[translation] = []
-            groups[translation].append(word_instance)
-
-    
-    # SORTING DICT
-    for dict_, type_name in [(classes, 'class'), (colors, 'color')]:
-        for word, attrs in dict_.items():
-            x = len(words) # len of words list
-            y = len(attrs['words'])
-            i = 0
-            while i < x and y > len(words[i]['words']):
-                i += 1
-            words.insert(i, {'code': word, 'type': type_name, 'label': attrs['label'], 'words': attrs['words']})
-
-    del_keys = []
-    for key, values in groups.items():
-        if len(values) <= 1: # values are lists, removing lists that have only one element
-            del_keys.append(key)
-    for key in del_keys:
-        del groups[key]
-
-    with open('groups.json', 'w') as f:
-        json.dump({'entries': words, 'groups': groups}, f, indent=4)
-
-
-with open('nyo.json', 'r') as f:
-    data = json.load(f)
-    get_graph(data)
+def get_graph(data): # data is the json file
+    atomic_write('groups.json', json.dumps(FicheIndex(data).groups_json(), indent=4))
 
 
+if __name__ == '__main__':
+    # groups.json and output.html from nyo.json, without a separate generator step
+    with open('nyo.json', 'r') as f:
+        FicheIndex(json.load(f)).materialize()
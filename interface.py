@@ -1,33 +1,56 @@
 import json
 import webbrowser
 import os
-from grapher_fiches import get_graph
+from grapher_fiches import FicheIndex
+from graph_model import GraphModel, render_ego
+from graph_view import GraphView
+from render_cache import RenderCache, EncodedSVG
+from render_pool import RenderPool, PoolClosedError
+from bulk_import import import_stream, guess_format, RowError, ON_EXISTING
+from search_index import SearchIndex
+from store import get_store, ConflictError, StoreBusyError
+from graph_fiches_generator import render_fiches
 # from grapher_plot import get_graph as get_graph_plot
-from flask import Flask, render_template, request, redirect
-
-def get_unique_id(data: dict) -> str: # dict from json file
-    ids = []
-    for word, attrs in data.items():
-        if word[0] == '/': # is a temporary id
-            ids.append(int(word[1:])) # following a /, it's all digits
-    if ids == []:
-        return '/1'
-    else:
-        m = max(ids)
-        return f"/{str(m+1)}" # returns next id for creating a new temporary id
+from flask import Flask, Response, jsonify, render_template, request, redirect, send_file, stream_with_context
+from flask_socketio import SocketIO
+
+def get_unique_id() -> str:
+    return store.new_temporary_id() # next id for creating a new temporary id, from the store's counter
 
 
 app = Flask("test", template_folder=os.getcwd())
+socketio = SocketIO(app)
+
+render_cache = RenderCache(directory=os.environ.get('NYO_RENDER_CACHE')) # svgs by dictionary state, also on disk if a directory is given
+encoded_svg = None # last graph served by /graph.svg, with its compressed versions
+graph_view = None # last native drawing indexed by position, for /view.svg
+
+store = get_store(os.environ.get('NYO_STORE', 'nyo.json')) # dictionary loaded once, edits are written behind, .db files use SQLite
+model = GraphModel(store.data, cache=render_cache, renderer=os.environ.get('NYO_RENDERER', 'graphviz'), # graph kept in memory, edits are applied to it as deltas, 'native' draws without graphviz
+                   layout_path=os.environ.get('NYO_LAYOUT', 'nyo.layout.json')) # native positions by word, kept across restarts
+store.subscribe(model.apply)
+render_pool = RenderPool(model, lock=store.lock) # renders in a worker process, pages get the last good svg meanwhile
+render_pool.subscribe(lambda patch: socketio.emit('graph', patch)) # open pages patch their graph, see graph_patch.html
+search_index = SearchIndex(store.data) # words, translations and descriptions, kept up to date like the model
+store.subscribe(search_index.apply)
+fiche_index = FicheIndex(store.data, lock=store.lock) # classes, colors and groups, groups.json and output.html are written from it when asked for
+store.subscribe(fiche_index.apply)
+
+@app.before_request
+def refresh_store():
+    store.refresh() # edits of the other workers, if several share the dictionary
+
+@app.errorhandler(StoreBusyError)
+def store_busy(e):
+    return Response('%s, try again' % e, status=503, mimetype='text/plain')
+
+@app.errorhandler(PoolClosedError)
+def render_pool_closed(e): # shutting down before the first render
+    return Response(str(e), status=503, mimetype='text/plain')
 
 @app.route('/')
 def main():
-    with open('nyo.json', 'r') as f:
-        data = json.load(f)
-        get_graph(data)
-
-    with open('nyo.svg', 'r') as f:
-        svg = f.read()
-        return render_template('index.html', graph=svg)
+    return render_template('index.html', zoomable=model.renderer == 'native') # /view needs native drawings
 
     get_graph_plot(data)
 
@@ -36,6 +59,99 @@ def main():
         return render_template('index.html', graph=svg, graph_plot=svg_plot)
 
 
+@app.route('/graph.svg')
+def graph_svg():
+    # pages fetch the graph from here, browsers keep it and only revalidate it with the etag
+    global encoded_svg
+    svg, version = render_pool.request()
+    encoded = encoded_svg
+    if encoded is None or encoded.version != version:
+        encoded = encoded_svg = EncodedSVG(svg, version)
+
+    encoding = encoded.negotiate(request.accept_encodings)
+    response = Response(encoded.encode(encoding), mimetype='image/svg+xml')
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['X-Graph-Version'] = str(version) # may be older than the dictionary while rendering
+    response.headers['X-Dictionary-Version'] = str(model.version)
+    response.cache_control.no_cache = True
+    response.set_etag(encoded.get_etag(encoding))
+    return response.make_conditional(request)
+
+
+@app.route('/graph/<path:word>')
+def ego_graph(word):
+    # only the words around one, for the edit page
+    depth = request.args.get('depth', 1, type=int)
+    if depth < 0:
+        return Response('The depth cannot be negative', status=400, mimetype='text/plain')
+    with store.lock:
+        if word not in model.nodes:
+            return Response('Unknown word `%s`' % word, status=404, mimetype='text/plain')
+        job = model.ego_snapshot(word, depth)
+    svg = job['svg']
+    if svg is None: # drawn without the lock, edits and other pages go on meanwhile
+        svg = render_ego(job)
+        with store.lock:
+            model.ego_rendered(job, svg)
+    return Response(svg, mimetype='image/svg+xml')
+
+
+@app.route('/view')
+def view():
+    # pan and zoom over large dictionaries, the page only ever holds what it shows
+    return render_template('view.html')
+
+
+@app.route('/view.svg')
+def view_svg():
+    global graph_view
+    with store.lock:
+        render_pool.request() # the latest edits are drawn meanwhile
+        parts, version = model.parts, model.parts_version
+    if parts is None:
+        return Response('Nothing to show yet, the view needs NYO_RENDERER=native', status=503, mimetype='text/plain')
+    view = graph_view
+    if view is None or view.version != version:
+        view = graph_view = GraphView(parts, version)
+
+    rect = [request.args.get(key, type=float) for key in ('x', 'y', 'w', 'h')] # in the drawing's units
+    rect = None if None in rect else rect
+    scale = request.args.get('scale', type=float) # pixels per unit
+    width, height = request.args.get('width', type=float), request.args.get('height', type=float) # pixels, before the page knows its scale
+    if not scale and width and height:
+        scale = view.fit_scale(rect, width, height)
+    response = Response(view.svg(rect, scale if scale else None), mimetype='image/svg+xml')
+    response.headers['X-Graph-Version'] = str(version)
+    return response
+
+
+@app.route('/search')
+def search():
+    query = request.args.get('q', '')
+    limit = request.args.get('limit', 20, type=int)
+    with store.lock:
+        return jsonify(search_index.search(query, limit))
+
+
+@app.route('/fiches')
+def fiches():
+    # written to output.html only when the dictionary changed, then served as a file;
+    # ?top= streams the largest boxes from the live ranking instead
+    top = request.args.get('top', type=int) # only the largest groups
+    if top is not None: # from the live ranking, nothing is written
+        return Response(stream_with_context(render_fiches(fiche_index.top(top))), mimetype='text/html')
+    fiche_index.materialize() # only if the dictionary changed since
+    return send_file(os.path.abspath('output.html'), mimetype='text/html')
+
+
+@app.route('/groups.json')
+def groups_json():
+    fiche_index.materialize()
+    return send_file(os.path.abspath('groups.json'), mimetype='application/json')
+
+
 @app.route('/add', methods=['POST'])
 def add():
     input_field = request.form['input']
@@ -45,65 +161,78 @@ def add():
     else:
         is_description = False
 
-    with open('nyo.json', 'r') as f:
-        data = json.load(f)
+    try:
+        if is_description:
+            # Actually just puts an additional tag
+            store.add(input_field, {
+                'description': '',
+                'tags': ['p'],
+                'translations': [],
+                'type': word_type
+            })
+        else:
+            store.add(input_field, {
+                'description': '',
+                'tags': [],
+                'translations': [],
+                'type': word_type
+            })
+    except (ConflictError, ValueError): # the input is already a key, or empty
+        return redirect('/')
 
-    if is_description:
-        # Actually just puts an additional tag
-        if input_field in data:
-            return redirect('/')
-        data[input_field] = {
-            'description': '',
-            'tags': ['p'],
-            'translations': [],
-            'type': word_type
-        }
-    else:
-        # Check if the input is a key
-        if input_field in data:
-            return redirect('/')
-        data[input_field] = {
-            'description': '',
-            'tags': [],
-            'translations': [],
-            'type': word_type
-    }
+    # rechargement du graph
+    render_pool.refresh() # pushed to the open pages once drawn
 
-    with open('nyo.json', 'w') as f:
-        json.dump(data, f, indent=4)
+    node = store.get(input_field)
+    node['id'] = input_field
+    node['version'] = store.get_version(input_field)
+    return render_template('modify.html', node=node)
 
-    # rechargement du graph
 
-    with open('nyo.json', 'r') as f:
-        data = json.load(f)
-        node = data[input_field]
-        node['id'] = input_field
-        get_graph(data)
+@app.route('/import', methods=['POST'])
+def bulk_import():
+    # csv or json lines of words, as a 'file' upload or as the body, see bulk_import.py
+    on_existing = request.args.get('on_existing', 'skip')
+    dry_run = request.args.get('dry_run', '') not in ('', '0')
+    if 'file' in request.files:
+        upload = request.files['file']
+        stream, format = upload.stream, request.args.get('format') or guess_format(upload.filename or '')
+    else:
+        stream, format = request.stream, request.args.get('format') or ('jsonl' if 'json' in (request.mimetype or '') else 'csv')
+    if format not in ('csv', 'jsonl') or on_existing not in ON_EXISTING:
+        return jsonify({'error': 'format must be csv or jsonl, on_existing one of %s' % ', '.join(ON_EXISTING)}), 400
 
-    with open('nyo.svg', 'r') as f:
-        svg = f.read()
-        return render_template('modify.html', graph=svg, node=node)
+    try:
+        report = import_stream(store, stream, format, on_existing, dry_run)
+    except RowError as e:
+        return jsonify({'error': str(e)}), 400
+    except ConflictError as e: # another worker added one of the words meanwhile
+        return jsonify({'error': str(e)}), 409
+    if report['applied']:
+        render_pool.refresh() # a single render for the whole import, pushed to the open pages
+    return jsonify(report), 400 if report['error_count'] else 200
+
+
+@app.route('/relayout', methods=['POST'])
+def relayout():
+    model.relayout() # the kept layout only ever places new words, this starts over
+    render_pool.refresh()
+    return redirect('/')
 
 
 @app.route('/modify', methods=['POST'])
 def modify_node():
     node_id = request.form['node-id']
-    with open('nyo.json', 'r') as f:
-        data = json.load(f)
-
-    with open('nyo.svg', 'r') as f:
-        svg = f.read()
-        node = data[node_id]
-        node['id'] = node_id
-        return render_template('modify.html', graph=svg, node=node)
+    node = store.get(node_id)
+    node['id'] = node_id
+    node['version'] = store.get_version(node_id)
+    return render_template('modify.html', node=node)
 
 
 @app.route('/update', methods=['POST'])
 def update_node():
-    with open('nyo.json', 'r') as f:
-        data = json.load(f)
-
     node_id = request.form['node-id']
+    version = int(request.form['version']) if 'version' in request.form.keys() else None # version the form was filled from
     # Retrieve the updated data for the node from the form submission
     word = request.form['word'] if 'word' in request.form.keys() else None
     description = request.form['description'] if 'description' in request.form.keys() else ""
@@ -116,26 +245,36 @@ def update_node():
     if translations == [""]:
         translations = []
 
-    if word is None or word == '':
-        data.pop(node_id) # deleting the node (node_id = word (previous value))
+    try:
+        if word is None or word == '':
+            store.delete(node_id, version) # deleting the node (node_id = word (previous value))
 
-    else:
-        if not word in data.keys():
-            data[word] = {}
-        data[word]['description'] = description
-        data[word]['type'] = type
-        data[word]['tags'] = tags
-        data[word]['translations'] = translations
+        else:
+            attrs = store.get(word) or {}
+            attrs['description'] = description
+            attrs['type'] = type
+            attrs['tags'] = tags
+            attrs['translations'] = translations
 
-        if node_id != word:
-            data.pop(node_id) # node has been renamed
+            if node_id != word:
+                store.rename(node_id, word, attrs, version) # node has been renamed
+            else:
+                store.update(word, attrs, version)
 
-    with open('nyo.json', 'w') as f:
-        json.dump(data, f, indent=4)
+    except ConflictError: # someone else edited the node meanwhile, showing their version
+        node = store.get(node_id)
+        if node is None: # deleted meanwhile
+            return redirect('/')
+        node['id'] = node_id
+        node['version'] = store.get_version(node_id)
+        return render_template('modify.html', node=node, conflict=True)
+    except ValueError: # blank word
+        return redirect('/')
 
+    render_pool.refresh() # pushed to the open pages once drawn
     return redirect('/')
 
 
 if __name__ == '__main__':
     #webbrowser.open('http://localhost:5000')
-    app.run()   
+    socketio.run(app, allow_unsafe_werkzeug=True)
@@ -0,0 +1,38 @@
+import json
+import os
+
+
+class Journal:
+    """ append-only file of store edits, one json op per line (see store.apply_op) """
+
+    def __init__(self, path):
+        self.path = path
+
+    def append(self, ops):
+        """ appends ops and waits for them to be on disk, returns the new end offset """
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(op, ensure_ascii=False) + '\n' for op in ops))
+            f.flush()
+            os.fsync(f.fileno())
+            return f.tell()
+
+    def read(self, offset=0):
+        """ ops of the journal from offset, and the offset following them.
+            A last line cut by a crash is ignored.
+        """
+        if not os.path.exists(self.path):
+            return [], 0
+        ops = []
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'): # partial write
+                    break
+                ops.append(json.loads(line.decode('utf-8')))
+                offset += len(line)
+        return ops, offset
+
+    def truncate(self):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.flush()
+            os.fsync(f.fileno())
@@ -0,0 +1,67 @@
+import unicodedata
+from functools import lru_cache
+
+WIDTH = 28 # widest line of a label, in narrow characters
+
+
+def char_width(char):
+    """ 2 for wide characters, 0 for combining ones, 1 otherwise """
+    if unicodedata.combining(char):
+        return 0
+    if unicodedata.east_asian_width(char) in ('W', 'F'):
+        return 2
+    return 1
+
+
+def text_width(text):
+    if text.isascii(): # no wide nor combining characters
+        return len(text)
+    return sum(char_width(char) for char in text)
+
+
+def wrap(text, width=WIDTH):
+    """ lines of at most width, words longer than that get a line of their own """
+    lines = []
+    line = []
+    line_width = 0
+    for word in text.split():
+        w = text_width(word)
+        if line and line_width + 1 + w > width:
+            lines.append(' '.join(line))
+            line = []
+            line_width = 0
+        line_width += w + (1 if line else 0)
+        line.append(word)
+    if line:
+        lines.append(' '.join(line))
+    return lines
+
+
+@lru_cache(maxsize=1 << 16)
+def _label(word, description, translations, tags):
+    lines = [('/' if 'p' in tags else '.') + word]
+    if translations:
+        lines += wrap('(' + ', '.join(translations) + ')')
+    lines += wrap(description)
+    return '\n'.join(lines)
+
+
+@lru_cache(maxsize=1 << 16)
+def _plot_label(word, description, translations):
+    if word[0] == '/': # no word yet
+        if not translations:
+            return '\n'.join(wrap(description))
+        return '\n'.join(wrap(', '.join(translations)))
+    if not translations:
+        return word
+    return '\n'.join([word] + wrap('(' + ', '.join(translations) + ')'))
+
+
+def get_label(word, attrs):
+    """ label of a word in the graph and in the fiches, computed once per content of the entry """
+    return _label(word, attrs['description'], tuple(attrs['translations']), tuple(attrs['tags']))
+
+
+def get_plot_label(word, attrs):
+    """ shorter label of other/grapher_plot.py, without the description of named words """
+    return _plot_label(word, attrs['description'], tuple(attrs['translations']))
@@ -1,9 +1,12 @@
-__all__ = ['SVGRenderer', 'hierarchy_layout']
+__all__ = ['SVGRenderer', 'hierarchy_layout', 'relax_layout', 'iter_parts', 'diff_parts']
 from svgwrite.path import Path
 from svgwrite.shapes import Rect, Line, Polygon, Circle
 from svgwrite.text import Text, TextPath, TSpan
 from svgwrite.container import Marker, Group
 from svgwrite import Drawing
+from svgwrite.utils import AutoID
+import numpy as np
+import hashlib
 import math
 
 _passthrough_ = [
@@ -45,11 +48,16 @@ def RichText(s, dy, **kwargs):
 
         \\n starts a new line
         \\a makes the line bold
+
+        id goes to the Text only, not to its lines
     """
     lines = s.split('\n')
     x, y = kwargs.pop('insert', (0, 0))
+    id = kwargs.pop('id', None)
     y = y - dy * (len(lines) - 1)
-    txt = Text('', insert=(x, y), **kwargs)
+    txt = Text('', insert=(x, y), debug=id is None, **kwargs) # ids may contain spaces
+    if id is not None:
+        txt.attribs['id'] = id
     for i, line in enumerate(lines):
         if len(line) > 0:
             if line[0] == '\a':
@@ -67,37 +75,339 @@ def RichText(s, dy, **kwargs):
 
     return txt
 
-def hierarchy_layout(g, thresh=6):
+def _escape_attrib(text): # as xml.etree writes attribute values
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;') \
+            .replace('\r', '&#13;').replace('\n', '&#10;').replace('\t', '&#09;')
+
+def _escape_cdata(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+def attributes(attribs):
+    """ attributes written as svgwrite's tostring would: svgwrite names (stroke_width, class_),
+        sorted, None and empty values left out
+    """
+    parts = []
+    for name, value in sorted([(key.rstrip('_').replace('_', '-'), value) for key, value in attribs.items()]):
+        if value is None:
+            continue
+        value = str(value)
+        if value:
+            parts.append(' %s="%s"' % (name, _escape_attrib(value)))
+    return ''.join(parts)
+
+def markup(tag, attribs, content=''):
+    """ an element as svgwrite's tostring would write it, content is the markup of the children """
+    if content:
+        return '<%s%s>%s</%s>' % (tag, attributes(attribs), content, tag)
+    return '<%s%s />' % (tag, attributes(attribs))
+
+def rich_text_markup(s, dy, transform=None, **kwargs):
+    """ the markup of RichText(s, dy, **kwargs), transform is its transform attribute """
+    lines = s.split('\n')
+    x, y = kwargs.pop('insert', (0, 0))
+    id = kwargs.pop('id', None)
+    y = y - dy * (len(lines) - 1)
+    tspans = []
+    for i, line in enumerate(lines):
+        if len(line) > 0:
+            if line[0] == '\a':
+                line = line[1:]
+                font_weight='bold'
+            else:
+                font_weight='normal'
+        else:
+            font_weight='normal'
+            line = " "
+        tspans.append(markup('tspan', dict(kwargs, x=x, y=y + dy * i, font_weight=font_weight), _escape_cdata(line)))
+
+    return markup('text', dict(kwargs, x=x, y=y, id=id, transform=transform), ''.join(tspans))
+
+LAYERS = ('nodes', 'edges', 'labels') # element lists of draw(backend='parts'), bottom to top
+
+def iter_parts(parts):
+    """ the svg of a draw(backend='parts') as string fragments """
+    yield parts['head']
+    yield markup('defs', {}, ''.join(parts['defs'].values()))
+    yield '<g>'
+    for id, fragment in parts['nodes']:
+        yield fragment
+    yield '</g>'
+    yield markup('g', {}, ''.join([fragment for id, fragment in parts['edges']]))
+    yield markup('g', {}, ''.join([fragment for id, fragment in parts['labels']]))
+    yield '</svg>'
+
+def diff_parts(old, new):
+    """ what to change in the drawing old to get new, both from draw(backend='parts'):
+        the markers to add to the defs, the ids of the elements to remove and,
+        by layer, the [id, markup] of the elements to add or replace.
+        None if the svg element itself differs or an element has no id.
+    """
+    if old['head'] != new['head']:
+        return None
+    patch = {'defs': [marker for id, marker in new['defs'].items() if id not in old['defs']], 'remove': []}
+    for layer in LAYERS:
+        before = dict(old[layer])
+        if None in before or None in dict(new[layer]):
+            return None
+        ids = set()
+        patch[layer] = []
+        for id, fragment in new[layer]:
+            ids.add(id)
+            if before.get(id) != fragment:
+                patch[layer].append([id, fragment])
+        patch['remove'] += [id for id in before if id not in ids]
+    return patch
+
+MAX_CLUSTER = 1000 # larger communities are cut, repulsion inside a cluster is quadratic in its size
+MIN_CLUSTER = 64 # smaller ones are packed together, repulsion between clusters is quadratic in their number
+GRAVITY = 1.0 # pull towards the center, relative to the distance
+
+def clusters(g, max_size=MAX_CLUSTER, min_size=MIN_CLUSTER):
+    """ groups of nearby nodes of g, as lists.
+
+        Communities are found by label propagation, the ones above max_size are cut
+        in breadth first order, the ones below min_size are packed together.
+    """
+    import networkx as nx
+    ug = nx.Graph(g) # undirected, single edges
+    rank = dict((node, i) for i, node in enumerate(ug)) # sets have no stable order across processes
+    communities = [sorted(community, key=rank.__getitem__) for community in nx.community.label_propagation_communities(ug)]
+    communities.sort(key=lambda community: (-len(community), rank[community[0]]))
+    groups = []
+    small = []
+    for community in communities:
+        if len(community) < min_size:
+            small += community
+            continue
+        if len(community) > max_size:
+            sub = ug.subgraph(community)
+            order = []
+            seen = set()
+            for root in community:
+                if root not in seen:
+                    component = list(nx.bfs_tree(sub, root))
+                    seen.update(component)
+                    order += component
+            community = order
+        for start in range(0, len(community), max_size):
+            groups.append(community[start:start + max_size])
+    for start in range(0, len(small), min_size):
+        groups.append(small[start:start + min_size])
+    return groups
+
+def _scatter_add(out, index, values):
+    """ out[index] += values with repeated indices summed, np.add.at is much slower """
+    for axis in range(out.shape[1]):
+        out[:, axis] += np.bincount(index, weights=values[:, axis], minlength=len(out))
+
+def _repulsion(xy, k2, out, weight=None):
+    """ adds to out the repulsion k2 / d of every point of xy on each one, by blocks of rows """
+    for start in range(0, len(xy), 1024):
+        delta = xy[start:start + 1024, None, :] - xy[None, :, :]
+        d2 = (delta ** 2).sum(axis=2)
+        np.maximum(d2, 1e-12, out=d2) # itself and coincident points
+        f = k2 / d2
+        if weight is not None:
+            f *= weight
+        out[start:start + 1024] += (delta * f[:, :, None]).sum(axis=1)
+
+def hierarchy_layout(g, thresh=6, iterations=50, pos=None, fixed=None, seed=None, gravity=GRAVITY):
     """ layout graph g with a hierarchy. 
         clusters of nodes are at nearby locations.
+
+        Nodes are grouped with clusters(), then all placed at once by a fixed number
+        of force directed iterations: attraction along edges, exact repulsion
+        inside a cluster, repulsion between the centers of clusters and a gravity
+        that keeps unconnected parts from drifting away.
+
+        pos: positions to start from, such as a previous layout. Nodes without one
+             start next to their positioned neighbors.
+        fixed: nodes of pos that stay where they are
+        seed: seed of the random initial placement
     """
 
     import networkx as nx
-    pos = {}
-    if len(g) < thresh:
+    if len(g) < thresh and pos is None:
         return nx.shell_layout(g)
 
-    g2 = g.subgraph(g.nodes())
-    if nx.is_weakly_connected(g2):
-        cutset = nx.minimum_edge_cut(g2)
-        g2.remove_edges_from(cutset)
-
-    subgraphs = list(nx.weakly_connected_component_subgraphs(g2))
-    regions = len(subgraphs)
+    nodes = list(g)
+    index = dict((node, i) for i, node in enumerate(nodes))
+    n = len(nodes)
+    rng = np.random.default_rng(seed)
+
+    groups = clusters(g)
+    cluster = np.zeros(n, dtype=int)
+    members = []
+    for c, group in enumerate(groups):
+        idx = np.array([index[node] for node in group], dtype=int)
+        cluster[idx] = c
+        members.append(idx)
+    mass = np.array([len(idx) for idx in members], dtype=float)
+
+    edges = np.array([(index[u], index[v]) for u, v in g.edges() if u != v], dtype=int).reshape(-1, 2)
+    u, v = edges[:, 0], edges[:, 1]
+
+    # initial placement
+    seeded = np.zeros(n, dtype=bool)
+    xy = np.zeros((n, 2))
+    for node, p in (pos or {}).items():
+        if node in index:
+            xy[index[node]] = p[:2]
+            seeded[index[node]] = True
+    if seeded.any():
+        lo, hi = xy[seeded].min(axis=0), xy[seeded].max(axis=0)
+        area = np.prod(hi - lo)
+        k = (area / n) ** 0.5 if area > 0 else n ** -0.5
+    else:
+        lo, hi = np.zeros(2), np.ones(2)
+        k = n ** -0.5
+    centers = lo + rng.random((len(groups), 2)) * (hi - lo)
+    for c, idx in enumerate(members):
+        if seeded[idx].any():
+            centers[c] = xy[idx[seeded[idx]]].mean(axis=0)
+    missing = np.flatnonzero(~seeded)
+    if len(missing):
+        # next to the positioned neighbors, or around the center of the cluster
+        adjacent = np.zeros((n, 2))
+        count = np.zeros(n)
+        for a, b in ((u, v), (v, u)):
+            known = seeded[b]
+            np.add.at(adjacent, a[known], xy[b[known]])
+            np.add.at(count, a[known], 1)
+        start = np.where((count > 0)[:, None], adjacent / np.maximum(count, 1)[:, None], centers[cluster])
+        spread = np.where(count > 0, k * 0.5, k * mass[cluster] ** 0.5)
+        xy[missing] = start[missing] + rng.normal(size=(len(missing), 2)) * spread[missing, None]
+
+    movable = np.ones(n, dtype=bool)
+    for node in fixed or ():
+        if node in index and seeded[index[node]]:
+            movable[index[node]] = False
+    if not movable.any():
+        return dict(zip(nodes, xy))
+    active = movable[u] | movable[v]
+    u, v = u[active], v[active]
+    members = [idx for idx in members if len(idx) > 1 and movable[idx].any()]
+
+    # a warm start only refines, a cold one may move nodes across the picture
+    extent = xy.max(axis=0) - xy.min(axis=0)
+    t = k if seeded.any() else max(extent.max(), k) * 0.1
+    dt = t / (iterations + 1)
+    k2 = k * k
+    for i in range(iterations):
+        disp = np.zeros((n, 2))
+        for idx in members:
+            inside = np.zeros((len(idx), 2))
+            _repulsion(xy[idx], k2, inside)
+            disp[idx] += inside
+        centroids = np.zeros((len(groups), 2))
+        _scatter_add(centroids, cluster, xy)
+        centroids /= mass[:, None]
+        between = np.zeros((len(groups), 2))
+        _repulsion(centroids, k2, between, weight=mass[None, :])
+        disp += between[cluster]
+        disp -= gravity * (xy - xy.mean(axis=0))
+
+        delta = xy[v] - xy[u]
+        d = (delta ** 2).sum(axis=1) ** 0.5
+        f = delta * (d / k)[:, None]
+        _scatter_add(disp, u, f)
+        _scatter_add(disp, v, -f)
+
+        disp[~movable] = 0
+        length = np.maximum((disp ** 2).sum(axis=1) ** 0.5, 1e-12)
+        xy += disp * (np.minimum(length, t) / length)[:, None]
+        t -= dt
+
+    return dict(zip(nodes, xy))
+
+def relax_layout(g, pos, nodes, iterations=30, seed=None):
+    """ places nodes in the existing layout pos, every other node of g stays where it is.
+
+        For adding or relinking a few nodes: only the nodes to place are moved and
+        computed on, the rest of the layout and so the picture are left untouched.
+        nodes without a position start next to their positioned neighbors.
+    """
 
-    if regions == 1:
-        return nx.shell_layout(g)
- 
-    centerg = nx.complete_graph(regions)
-    k = (1.0 * regions) ** -0.5
-    centerpos = nx.spring_layout(centerg, iterations=20)
-
-    for sgi, sg in enumerate(subgraphs):
-        mypos = hierarchy_layout(sg, thresh=thresh)
-        for node in mypos:
-            pos[node] = [
-                    centerpos[sgi][i] + 0.5 * (mypos[node][i] - 0.5) * k for i in range(2)]
-    
+    import networkx as nx
+    pos = dict(pos)
+    nodes = [node for node in nodes if node in g]
+    if not nodes:
+        return pos
+    rng = np.random.default_rng(seed)
+    moving = dict((node, i) for i, node in enumerate(nodes))
+
+    others = [node for node in pos if node in g and node not in moving]
+    fixed_xy = np.array([pos[node] for node in others], dtype=float).reshape(-1, 2)
+    n = len(others) + len(nodes)
+    if len(fixed_xy):
+        lo, hi = fixed_xy.min(axis=0), fixed_xy.max(axis=0)
+        area = np.prod(hi - lo)
+    else:
+        lo, hi, area = np.zeros(2), np.ones(2), 0
+    k = (area / n) ** 0.5 if area > 0 else n ** -0.5
+
+    # edges of the moving nodes, the other end either moving or fixed
+    links = []
+    xy = np.zeros((len(nodes), 2))
+    for node, i in moving.items():
+        placed = []
+        for other in (nx.all_neighbors(g, node) if g.is_directed() else g.neighbors(node)):
+            if other == node:
+                continue
+            if other in moving:
+                links.append((i, moving[other], None))
+            elif other in pos:
+                links.append((i, -1, pos[other]))
+                placed.append(pos[other])
+        if node in pos:
+            xy[i] = pos[node]
+        elif placed:
+            xy[i] = np.mean(placed, axis=0) + rng.normal(size=2) * k * 0.5
+        else:
+            xy[i] = lo + rng.random(2) * (hi - lo)
+
+    u = np.array([j for j, other, p in links if other >= 0], dtype=int)
+    v = np.array([other for j, other, p in links if other >= 0], dtype=int)
+    w = np.array([j for j, other, p in links if other < 0], dtype=int)
+    anchors = np.array([p for j, other, p in links if other < 0], dtype=float).reshape(-1, 2)
+
+    t = k
+    dt = t / (iterations + 1)
+    k2 = k * k
+
+    # pairs of a moving node and a fixed node close enough to ever push it,
+    # nodes travel less than the sum of the temperatures
+    reach = t * (iterations + 1) * 0.5 + 2 * k
+    near_i = []
+    near_j = []
+    for start in range(0, len(xy), 256):
+        close = (np.abs(xy[start:start + 256, None, :] - fixed_xy[None, :, :]) <= reach).all(axis=2)
+        i, j = np.nonzero(close)
+        near_i.append(i + start)
+        near_j.append(j)
+    near_i = np.concatenate(near_i)
+    near_xy = fixed_xy[np.concatenate(near_j)]
+
+    for i in range(iterations):
+        disp = np.zeros((len(nodes), 2))
+        _repulsion(xy, k2, disp)
+        # only the close fixed nodes push, the layout around is already balanced
+        delta = xy[near_i] - near_xy
+        d2 = np.maximum((delta ** 2).sum(axis=1), 1e-12)
+        _scatter_add(disp, near_i, delta * np.where(d2 < 4 * k2, k2 / d2, 0)[:, None])
+
+        # each link between moving nodes is seen from both of its ends
+        delta = xy[v] - xy[u]
+        _scatter_add(disp, u, delta * ((delta ** 2).sum(axis=1) ** 0.5 / k)[:, None])
+        delta = anchors - xy[w]
+        _scatter_add(disp, w, delta * ((delta ** 2).sum(axis=1) ** 0.5 / k)[:, None])
+
+        length = np.maximum((disp ** 2).sum(axis=1) ** 0.5, 1e-12)
+        xy += disp * (np.minimum(length, t) / length)[:, None]
+        t -= dt
+
+    for node, i in moving.items():
+        pos[node] = xy[i]
     return pos
 
 class SVGRenderer(object):
@@ -108,7 +418,8 @@ class SVGRenderer(object):
             FontSize = 20.,
             NodePadding = 0.25,
             EdgeSpacing = 2.,
-            LineSpacing = 1.5):
+            LineSpacing = 1.5,
+            StableIds = False):
         """ creates a SVGRender with these configurations:
 
             GlobalScale: units of the image
@@ -119,6 +430,9 @@ class SVGRenderer(object):
             NodePadding: padding within a node from text to the rect, in FontSize
             LineSpacing: spacing between lines with in a label, in FontSize
             EdgeSpacing: spacing between parallel edges, in FontSize
+
+            StableIds: marker ids made from the marker instead of counted,
+                       so that drawings of a changing graph share them
         """
 
 
@@ -129,6 +443,8 @@ class SVGRenderer(object):
         self.NodePadding = NodePadding
         self.EdgeSpacing = EdgeSpacing
         self.LineSpacing = LineSpacing
+        self.StableIds = StableIds
+        self.stats = {} # marker counts of the last draw, see draw
 
     def get_size(self, labeltxt, font_size):
         """ return size of label text in unitary cooridnate """
@@ -161,6 +477,19 @@ class SVGRenderer(object):
         phase = ang // 90
         #print pos, otherpos, ang, phase, anchors[phase]
         return anchors[phase]
+    ANCHORS = np.array([
+            (1.0, 0.5),
+            (0.5, 0.0),
+            (0., 0.5),
+            (0.5, 1.0)])
+    def get_anchors(self, pos, otherpos):
+        """ get_anchor for arrays of positions, one anchor per row """
+        diff = otherpos - pos
+        # the svg coordinate has wrong handness
+        ang = np.arctan2(-diff[:, 1], diff[:, 0])
+        ang = np.trunc(ang / np.pi * 180).astype(int) # same rounding as int()
+        ang = (ang + 45) % 360
+        return self.ANCHORS[ang // 90]
     def get_anchor2(self, i):
         """ returns the anchor point of the edge
             in size of the node box
@@ -185,7 +514,13 @@ class SVGRenderer(object):
                 return p
             return a
         return tuple([f(a, b, c) for a, b, c in zip(v, s, [asp, 1.0])])
-    def makemarker(self, symbol, size, stroke, stroke_width, fill, type, units):
+    def clip_all(self, v, s, asp):
+        """ clip for arrays of positions and sizes, one node box per row """
+        p = self.Margin / self.GlobalScale
+        c = np.array([asp, 1.0])
+        return np.where(v + s > c - p, c - p - s, np.where(v < p, p, v))
+    def marker_spec(self, symbol, size, stroke, stroke_width, fill, type, units):
+        """ the Marker arguments of a marker and the name and arguments of its shape """
         if type == 'marker_start':
             refX, refY = 0.0, 0.5
         if type == 'marker_mid':
@@ -196,30 +531,179 @@ class SVGRenderer(object):
             stroke_width = 0
         size1 = size + stroke_width * 2
         sw = stroke_width
-        marker = Marker(orient='auto', markerUnits=units, size=(size1, size1), 
+        marker = dict(orient='auto', markerUnits=units, size=(size1, size1), 
                 refX=refX * size1, refY=refY * size1)
         if symbol[0] == 't':
-            marker.add(Polygon(points=[(sw, sw+0.2 * size), (sw + size, sw + 0.5 * size), (sw, sw + 0.8 * size)], 
+            shape = 'polygon', dict(points=[(sw, sw+0.2 * size), (sw + size, sw + 0.5 * size), (sw, sw + 0.8 * size)], 
                 fill=stroke, 
-                stroke='none'))
+                stroke='none')
         elif symbol[0] == '.':
-            marker.add(Circle(center=(sw + 0.5 * size, sw + 0.5 * size), 
-                r=0.5 * size, fill=stroke, stroke='none'))
+            shape = 'circle', dict(center=(sw + 0.5 * size, sw + 0.5 * size), 
+                r=0.5 * size, fill=stroke, stroke='none')
         elif symbol[0].upper() == 'A':
-            marker.add(Polygon(points=[(sw, sw+0.2 * size), (sw + size, sw + 0.5 * size), (sw, sw + 0.8 * size)], 
+            shape = 'polygon', dict(points=[(sw, sw+0.2 * size), (sw + size, sw + 0.5 * size), (sw, sw + 0.8 * size)], 
                 fill=fill, stroke=stroke, 
-                stroke_width=stroke_width, stroke_linecap='round'))
+                stroke_width=stroke_width, stroke_linecap='round')
         elif symbol[0].upper() == 'O':
-            marker.add(Circle(center=(sw + 0.5 * size, sw + 0.5 * size), 
-                r=0.5 * size, stroke=stroke, fill=fill, stroke_width=stroke_width))
+            shape = 'circle', dict(center=(sw + 0.5 * size, sw + 0.5 * size), 
+                r=0.5 * size, stroke=stroke, fill=fill, stroke_width=stroke_width)
         else:
             raise ValueError("Marker type `%s` unknown" % type)
+        return marker, shape
+
+    def marker_id(self, *key):
+        """ id of the marker of these makemarker arguments, None to let svgwrite count them """
+        if not self.StableIds:
+            return None
+        return 'marker-' + hashlib.md5(repr(key).encode('utf-8')).hexdigest()[:12]
+
+    def makemarker(self, symbol, size, stroke, stroke_width, fill, type, units):
+        attribs, (name, shape) = self.marker_spec(symbol, size, stroke, stroke_width, fill, type, units)
+        marker = Marker(**attribs)
+        if self.StableIds:
+            marker['id'] = self.marker_id(symbol, size, stroke, stroke_width, fill, type, units)
+        if name == 'polygon':
+            marker.add(Polygon(**shape))
+        else:
+            marker.add(Circle(**shape))
         return marker
 
+    def marker_markup(self, symbol, size, stroke, stroke_width, fill, type, units):
+        """ makemarker as a string, with the id svgwrite would have given it """
+        attribs, (name, shape) = self.marker_spec(symbol, size, stroke, stroke_width, fill, type, units)
+        width, height = attribs.pop('size')
+        attribs.update(markerWidth=width, markerHeight=height,
+                id=self.marker_id(symbol, size, stroke, stroke_width, fill, type, units) or AutoID.next_id())
+        if name == 'polygon':
+            shape['points'] = ' '.join(['%s,%s' % point for point in shape['points']])
+        else:
+            shape['cx'], shape['cy'] = shape.pop('center')
+        return attribs['id'], markup('marker', attribs, markup(name, shape))
+
+    def _edge_style(self, prop, directed):
+        """ takes the drawing properties of an edge out of prop, defaults filled in.
+            Returns the path attributes, the markers as (type, makemarker arguments) and the label font size.
+        """
+        prop.pop('position', 0)
+        stroke_width = prop.pop('stroke_width', self.LineWidth)
+        marker_stroke_width = prop.pop('marker_stroke_width', stroke_width)
+        fill = prop.pop('fill', 'none')
+        marker_fill = prop.pop('marker_fill', 'none')
+        stroke = prop.pop('stroke', 'black')
+        stroke_linecap = prop.pop('stroke_linecap', 'butt')
+
+        markerUnits = prop.pop('marker_units', 'userSpaceOnUse')
+        markerSize = prop.pop('marker_size', self.FontSize)
+        font_size = prop.pop('font_size', self.FontSize)
+        markers = []
+        for type in ['marker_mid', 'marker_start', 'marker_end']:
+            symbol = prop.pop(type, 'none')
+            if directed and type == 'marker_mid' and symbol == 'none':
+                symbol = 't'
+            if symbol == 'none': continue
+            markers.append((type, (symbol, markerSize, stroke, marker_stroke_width, marker_fill, type, markerUnits)))
+
+        prop.update(stroke_width=stroke_width, fill=fill, stroke=stroke, stroke_linecap=stroke_linecap)
+        return prop, markers, font_size
+
+    def _node_style(self, prop):
+        """ takes the drawing properties of a node out of prop, defaults filled in.
+            Returns the rect attributes and the label font size.
+        """
+        prop.pop('position', 0)
+        stroke = prop.pop('stroke', 'black')
+        fill = prop.pop('fill', 'none')
+        stroke_width = prop.pop('stroke_width', self.LineWidth)
+        rx = prop.pop('rx', self.FontSize)
+        ry = prop.pop('ry', self.FontSize)
+        font_size = prop.pop('font_size', self.FontSize)
+        prop.update(stroke_width=stroke_width, stroke=stroke, fill=fill, rx=rx, ry=ry)
+        return prop, font_size
+
+    def _geometry(self, g, pos, aspect, nodeformatter, bounds=None):
+        """ node boxes, edge curves and label positions in viewbox coordinates,
+            computed for all nodes and edges at a time
+        """
+        # formatting once
+        nodes = []
+        node_labels = []
+        node_props = []
+        for node, data in g.nodes(data=True):
+            label, prop = nodeformatter(node, data)
+            nodes.append(node)
+            node_labels.append(label)
+            node_props.append(prop)
+        index = dict((node, i) for i, node in enumerate(nodes))
+
+        wh = np.array([self.get_size(label, prop.get('font_size', self.FontSize))
+                for label, prop in zip(node_labels, node_props)], dtype=float).reshape(-1, 2)
+        xy = np.array([prop['position'] if 'position' in prop else pos[node]
+                for node, prop in zip(nodes, node_props)], dtype=float).reshape(-1, 2)
+
+        # normalize input pos to 0 ~ 1, then shift so that center is correct
+        if bounds is None:
+            xymin = xy.min(axis=0)
+            xymax = xy.max(axis=0)
+        else:
+            xymin, xymax = np.array(bounds, dtype=float)
+        span = xymax - xymin
+        frame = np.array([aspect, 1.0])
+        xy = np.where(span > 0, frame * (xy - xymin) / np.where(span > 0, span, 1), frame * 0.5) # a single node is centered
+        xy = self.clip_all(xy - wh * 0.5, wh, aspect)
+
+        edges = list(g.edges(data=True))
+        u = np.array([index[e[0]] for e in edges], dtype=int)
+        v = np.array([index[e[1]] for e in edges], dtype=int)
+
+        # parallel edges
+        drawn = {}
+        parallel = np.zeros(len(edges))
+        for k, (a, b, data) in enumerate(edges):
+            nedges = g.number_of_edges(a, b)
+            if g.is_directed():
+                nedges += g.number_of_edges(b, a)
+            i = drawn.pop((a, b), 0)
+            drawn[(a, b)] = i + 1
+            parallel[k] = 2 * i - (nedges - 1)
+
+        p1 = xy[u]
+        p2 = xy[v]
+        loop = (p1 == p2).all(axis=1)
+        a = np.where(loop[:, None], self.ANCHORS[parallel.astype(int) % 4], self.get_anchors(p1, p2))
+        p1 = p1 + wh[u] * a
+        # the anchor on v faces the anchor already chosen on u
+        a = np.where(loop[:, None], self.ANCHORS[(parallel.astype(int) - 1) % 4], self.get_anchors(p2, p1))
+        p2 = p2 + wh[v] * a
+        p1 = p1 * self.GlobalScale
+        p2 = p2 * self.GlobalScale
+        d = p2 - p1
+        ang = np.arctan2(d[:, 1], d[:, 0])
+        l = (d[:, 1] ** 2 + d[:, 0] ** 2) ** 0.5
+        normal = np.stack([-d[:, 1] / l, d[:, 0] / l], axis=1)
+        fac = np.where(loop, 2.0, 1.0)
+
+        # middle of the edge
+        txtp = (p1 + p2) * 0.5 + (fac * self.EdgeSpacing * self.FontSize * parallel)[:, None] * normal
+        # control point
+        controlp = (txtp - (p1 + p2) * 0.25) * 2
+
+        xy = xy * self.GlobalScale
+        wh = wh * self.GlobalScale
+        node_txtp = np.stack([xy[:, 0] + wh[:, 0] * 0.5,
+                xy[:, 1] + wh[:, 1] - self.NodePadding * self.FontSize], axis=1)
+
+        # python floats from here, for the backends
+        return dict(nodes=nodes, node_labels=node_labels, node_props=node_props,
+                node_xy=xy.tolist(), node_wh=wh.tolist(), node_txtp=node_txtp.tolist(),
+                edges=edges, p1=p1.tolist(), p2=p2.tolist(),
+                q1=((p1 + controlp) * 0.5).tolist(), q2=((controlp + p2) * 0.5).tolist(),
+                txtp=txtp.tolist(), rotation=(180. / np.pi * ang + 180).tolist())
+
     def draw(self, g, pos=None,
             size=('600px', '400px'), 
             nodeformatter=DefaultNodeFormatter, 
-            edgeformatter=DefaultEdgeFormatter):
+            edgeformatter=DefaultEdgeFormatter,
+            id=None, backend='svgwrite', out=None, bounds=None):
         """ 
 
         Draw graph g to a svg file, return the content as a string.
@@ -255,10 +739,51 @@ class SVGRenderer(object):
                 marker_stroke_width: stroke width of the marker, in marker_units
                 marker_stroke: stroke color of a shape marker or the color of 'inside' symbols
                 marker_fill: fill color of a shape marker
+
+        Identical markers are defined once in the defs and shared by every edge that uses them,
+        self.stats then tells how many were used and the svg bytes that saved.
+
+        id: id of the svg element. Each node is drawn in a group of class `node`
+            with the node as id, so that a page can find the nodes it was clicked on.
+            Edges with an `id` attribute get it as the id of their path, and
+            their label that id followed by ':label'.
+
+        backend: 'svgwrite' builds and validates svgwrite elements,
+                 'string' writes the same markup directly as strings, without validation,
+                 'parts' returns that markup by element, see iter_parts and diff_parts.
+
+        out: with the string backend, a file-like object the svg is written to
+             piece by piece instead of being returned.
+
+        bounds: ((xmin, ymin), (xmax, ymax)) of pos to fit in the picture, those of pos by default.
+            Drawings of a changing graph with the same bounds and GlobalScale line up.
         """
-        dwg = Drawing(size=size) #, profile='basic', version=1.2)
+        if pos is None:
+            pos = hierarchy_layout(g)
+
         aspect = 1.0 * int(size[0].replace('px', '')) / int(size[1].replace('px', ''))
-        dwg.viewbox(minx=-self.Margin * aspect, miny=-self.Margin, width=aspect * self.GlobalScale + 2 * self.Margin * aspect, height=self.GlobalScale + 2 * self.Margin)
+        viewbox = (-self.Margin * aspect, -self.Margin, aspect * self.GlobalScale + 2 * self.Margin * aspect, self.GlobalScale + 2 * self.Margin)
+        geometry = self._geometry(g, pos, aspect, nodeformatter, bounds)
+
+        if backend == 'svgwrite':
+            return self._draw_svgwrite(g, geometry, size, viewbox, edgeformatter, id)
+        if backend == 'parts':
+            return self._parts(g, geometry, size, viewbox, edgeformatter, id)
+        if backend != 'string':
+            raise ValueError("Backend `%s` unknown" % backend)
+
+        fragments = iter_parts(self._parts(g, geometry, size, viewbox, edgeformatter, id))
+        if out is None:
+            return ''.join(fragments)
+        for fragment in fragments:
+            out.write(fragment)
+
+    def _draw_svgwrite(self, g, geometry, size, viewbox, edgeformatter, id):
+        if id is None:
+            dwg = Drawing(size=size) #, profile='basic', version=1.2)
+        else:
+            dwg = Drawing(size=size, id=id)
+        dwg.viewbox(*viewbox)
         dwg.fit()
         label_layer = Group()
         node_layer = Group()
@@ -268,206 +793,180 @@ class SVGRenderer(object):
         dwg.add(edge_layer)
         dwg.add(label_layer)
 
-        if pos is None:
-            pos = hierarchy_layout(g)
-
-        pos = pos.copy()
-        x = []
-        y = []
-        size = {}
-
-        for node, data in g.nodes_iter(data=True):
-            label, prop = nodeformatter(node, data)
-            font_size = prop.pop('font_size', self.FontSize)
-            size[node] = self.get_size(label, font_size)
-            if 'position' in prop:
-                pos[node] = prop['position']
-            p = pos[node]
-            x.append(p[0])
-            y.append(p[1])
-
-        xmin = min(x)
-        xmax = max(x)
-        ymin = min(y)
-        ymax = max(y)
-        # normalize input pos to 0 ~ 1
-        for node in g.nodes_iter():
-            p = pos[node]
-            p = (aspect * (p[0] - xmin) / (xmax - xmin),
-                 1.0 * (p[1] - ymin) / (ymax - ymin) )
-
-            wh = size[node]
-            p = tuple([p[i] - wh[i] * 0.5 for i in range(2)])
-            p = self.clip(p, wh, aspect)
-            # shift so that center is correct
-            pos[node] = p
-
-
         # draw the edges
-        drawn = {}
-
-        for u, v, data in g.edges_iter(data=True):
-            label, prop = edgeformatter(u, v, data)
-            prop.pop('position', 0)
-
-            # parallel edges
-            nedges = g.number_of_edges(u, v)
-            if g.is_directed():
-                nedges += g.number_of_edges(v, u)
-            if u <= v:
-                key = (u, v)
-            else:
-                key = (v, u)
-            i = drawn.pop((u, v), 0)
-
-            drawn[(u, v)] = i + 1
-            i =  2 * i - (nedges - 1)
-
-            p1 = pos[u]
-            p2 = pos[v]
-            if p1 != p2:
-                oldp1 = p1
-                oldp2 = p2
-                a = self.get_anchor(p1, p2)
-                p1 = p1[0] + size[u][0] * a[0], p1[1] + size[u][1] * a[1]
-                a = self.get_anchor(p2, p1)
-                p2 = p2[0] + size[v][0] * a[0], p2[1] + size[v][1] * a[1]
-                p1 = self.scale(p1)
-                p2 = self.scale(p2)
-
-                ang = math.atan2((p2[1] - p1[1]), p2[0] - p1[0]) 
-
-                l = ((p2[1] - p1[1]) ** 2 + (p2[0] - p1[0]) ** 2) ** 0.5
-                dx = -(p2[1] - p1[1]) / l 
-                dy = (p2[0] - p1[0]) / l 
-
-                fac = 1.0
-            else:
-                a = self.get_anchor2(i)
-                p1 = p1[0] + size[u][0] * a[0], p1[1] + size[u][1] * a[1]
-                a = self.get_anchor2(i - 1)
-                p2 = p2[0] + size[v][0] * a[0], p2[1] + size[v][1] * a[1]
-                p1 = self.scale(p1)
-                p2 = self.scale(p2)
-                ang = math.atan2((p2[1] - p1[1]), p2[0] - p1[0]) 
-
-                l = ((p2[1] - p1[1]) ** 2 + (p2[0] - p1[0]) ** 2) ** 0.5
-                dx = -(p2[1] - p1[1]) / l 
-                dy = (p2[0] - p1[0]) / l 
-                fac = 2.0
-            
-            # middle of the edge
-            txtp = (p1[0] + p2[0]) * 0.5 + fac * self.EdgeSpacing * self.FontSize * i * dx, \
-                    (p1[1] + p2[1]) * 0.5 + fac * self.EdgeSpacing * self.FontSize * i * dy 
-            # control point
-            controlp = tuple([
-                    (txtp[i] - (p1[i] + p2[i]) * 0.25) * 2
-                    for i in range(2)])
-                
-            grp = Group()
-            stroke_width = prop.pop('stroke_width', self.LineWidth)
-            marker_stroke_width = prop.pop('marker_stroke_width', stroke_width)
-            fill = prop.pop('fill', 'none')
-            marker_fill = prop.pop('marker_fill', 'none')
-            stroke = prop.pop('stroke', 'black')
-            stroke_linecap = prop.pop('stroke_linecap', 'butt')
-
-            markerUnits = prop.pop('marker_units', 'userSpaceOnUse')
-            markerSize = prop.pop('marker_size', self.FontSize)
-            font_size = prop.pop('font_size', self.FontSize)
-            for type in ['marker_mid', 'marker_start', 'marker_end']:
-                symbol = prop.pop(type, 'none')
-                if g.is_directed() and type == 'marker_mid' and symbol == 'none':
-                    symbol = 't'
-                if symbol == 'none': continue
-                marker = self.makemarker(symbol=symbol, size=markerSize, 
-                        units=markerUnits, stroke_width=marker_stroke_width, 
-                        stroke=stroke, fill=marker_fill, type=type)
-                dwg.defs.add(marker)
+        markers = {} # makemarker arguments -> marker shared by every edge using them
+        marker_uses = 0
+        bytes_saved = 0
+
+        p1, p2, q1, q2, txtp = geometry['p1'], geometry['p2'], geometry['q1'], geometry['q2'], geometry['txtp']
+        for k, (a, b, data) in enumerate(geometry['edges']):
+            label, prop = edgeformatter(a, b, data)
+            prop, edge_markers, font_size = self._edge_style(prop, g.is_directed())
+            for type, key in edge_markers:
+                marker_uses += 1
+                if key in markers:
+                    marker = markers[key]
+                    bytes_saved += len(marker.tostring())
+                else:
+                    marker = self.makemarker(*key)
+                    dwg.defs.add(marker)
+                    markers[key] = marker
                 prop[type] = marker.get_funciri()
 
             edge = Path(d=[
-                    ('M', p1[0], p1[1]), 
-                    ('Q', midpoint(p1, controlp), txtp),
-                    ('Q', midpoint(controlp, p2), p2),
+                    ('M', p1[k][0], p1[k][1]), 
+                    ('Q', tuple(q1[k]), tuple(txtp[k])),
+                    ('Q', tuple(q2[k]), tuple(p2[k])),
                     ],
-                    stroke_width=stroke_width,
-                    fill=fill,
-                    stroke=stroke,
-                    stroke_linecap=stroke_linecap,
+                    debug='id' not in data, # ids may contain spaces
                     **prop)
+            if 'id' in data:
+                edge.attribs['id'] = data['id']
 
             edge_layer.add(edge)
 
+            if label == '': # no text for unlabeled edges
+                continue
             txt = RichText(label, 
                     dy=self.LineSpacing * font_size,
                     font_size=font_size, 
                     font_family='monospace', 
+                    id=data['id'] + ':label' if 'id' in data else None,
                     text_anchor="middle",
-                    insert=txtp, 
+                    insert=tuple(txtp[k]), 
                     )
             # I am confused by there is no negtive sign before y diff
-            txt.rotate( 180. / math.pi * ang + 180,
-                    center=txtp)
+            txt.rotate(geometry['rotation'][k],
+                    center=tuple(txtp[k]))
             # raise away from the edge by half a line
             txt.translate(tx=0, ty=-font_size * 0.5)
             label_layer.add(txt)
 
-        # draw the nodes
-        for node, data in g.nodes_iter(data=True):
-            label, prop = nodeformatter(node, data)
-            prop.pop('position', 0)
-            p = pos[node]
-            wh = size[node]
-            wh, p = self.scale(wh), self.scale(p)
-            grp = Group()
-            stroke = prop.pop('stroke', 'black')
-            fill = prop.pop('fill', 'none')
-            stroke_width = prop.pop('stroke_width', self.LineWidth)
-            rx = prop.pop('rx', self.FontSize)
-            ry = prop.pop('ry', self.FontSize)
-            font_size = prop.pop('font_size', self.FontSize)
-            ele = Rect(insert=p, size=wh, 
-                    stroke_width=stroke_width,
-                    stroke=stroke,
-                    fill=fill,
-                    rx=rx,
-                    ry=ry,
-                    **prop
-                    )
-            node_layer.add(ele)
+        self.stats = dict(markers=len(markers), marker_uses=marker_uses, bytes_saved=bytes_saved)
 
-            txtp =( p[0] + wh[0] * 0.5, 
-                    p[1] + wh[1] - self.NodePadding * self.FontSize)
+        # draw the nodes
+        for k, node in enumerate(geometry['nodes']):
+            label = geometry['node_labels'][k]
+            prop, font_size = self._node_style(geometry['node_props'][k])
+            grp = Group(id=str(node), class_='node', debug=False) # words may contain spaces
+            ele = Rect(insert=tuple(geometry['node_xy'][k]), size=tuple(geometry['node_wh'][k]), **prop)
+            grp.add(ele)
 
             txt = RichText(label, 
                     dy=self.LineSpacing * font_size,
-                    insert=txtp, 
+                    insert=tuple(geometry['node_txtp'][k]), 
                     font_family='monospace', 
                     font_size=font_size, 
                     text_anchor="middle")
 
             # raise away from the edge by half a line
             txt.translate(tx=0, ty=-font_size * 0.5)
-            label_layer.add(txt)
+            grp.add(txt)
+            node_layer.add(grp)
         return dwg.tostring()
 
+    def _parts(self, g, geometry, size, viewbox, edgeformatter, id):
+        """ markup of the same svg as _draw_svgwrite, by element.
+            Also gives the viewbox, the bounding box of each element with an id
+            and the ends of each edge with an id.
+        """
+        defs = {} # marker id -> markup
+        boxes = {}
+        ends = {}
+        edge_layer = []
+        label_layer = []
+
+        # the edges first, their markers go in the defs at the top
+        markers = {} # makemarker arguments -> marker id
+        marker_uses = 0
+        bytes_saved = 0
+
+        p1, p2, q1, q2, txtp = geometry['p1'], geometry['p2'], geometry['q1'], geometry['q2'], geometry['txtp']
+        for k, (a, b, data) in enumerate(geometry['edges']):
+            label, prop = edgeformatter(a, b, data)
+            prop, edge_markers, font_size = self._edge_style(prop, g.is_directed())
+            for type, key in edge_markers:
+                marker_uses += 1
+                if key in markers:
+                    marker_id = markers[key]
+                    bytes_saved += len(defs[marker_id])
+                else:
+                    marker_id, defs[marker_id] = self.marker_markup(*key)
+                    markers[key] = marker_id
+                prop[type] = 'url(#%s)' % marker_id
+
+            edge_id = data.get('id')
+            prop['id'] = edge_id
+            if edge_id is not None: # the control points bound the curve
+                points = [p1[k], q1[k], txtp[k], q2[k], p2[k]]
+                boxes[edge_id] = [min(p[0] for p in points), min(p[1] for p in points),
+                        max(p[0] for p in points), max(p[1] for p in points)]
+                ends[edge_id] = [str(a), str(b)]
+            prop['d'] = 'M %s %s Q %s %s %s %s Q %s %s %s %s' % tuple(
+                    p1[k] + q1[k] + txtp[k] + q2[k] + p2[k])
+            edge_layer.append((edge_id, markup('path', prop)))
+
+            if label == '': # no text for unlabeled edges
+                continue
+            transform = 'rotate(%s,%s,%s) translate(0,%s)' % (
+                    geometry['rotation'][k], txtp[k][0], txtp[k][1], -font_size * 0.5)
+            label_id = edge_id + ':label' if edge_id is not None else None
+            label_layer.append((label_id, rich_text_markup(label, 
+                    dy=self.LineSpacing * font_size,
+                    transform=transform,
+                    id=label_id,
+                    font_size=font_size, 
+                    font_family='monospace', 
+                    text_anchor="middle",
+                    insert=txtp[k], 
+                    )))
+
+        self.stats = dict(markers=len(markers), marker_uses=marker_uses, bytes_saved=bytes_saved)
+
+        head = '<svg%s>' % attributes({
+                'baseProfile': 'full', 'version': '1.1', 'id': id,
+                'width': size[0], 'height': size[1],
+                'viewBox': ','.join([str(value) for value in viewbox]),
+                'preserveAspectRatio': 'xMidYMid meet',
+                'xmlns': 'http://www.w3.org/2000/svg',
+                'xmlns:xlink': 'http://www.w3.org/1999/xlink',
+                'xmlns:ev': 'http://www.w3.org/2001/xml-events'})
+
+        # the nodes
+        node_layer = []
+        for k, node in enumerate(geometry['nodes']):
+            label = geometry['node_labels'][k]
+            prop, font_size = self._node_style(geometry['node_props'][k])
+            prop['x'], prop['y'] = geometry['node_xy'][k]
+            prop['width'], prop['height'] = geometry['node_wh'][k]
+            boxes[str(node)] = [prop['x'], prop['y'], prop['x'] + prop['width'], prop['y'] + prop['height']]
+            node_layer.append((str(node), markup('g', {'class_': 'node', 'id': str(node)}, markup('rect', prop) + rich_text_markup(label, 
+                    dy=self.LineSpacing * font_size,
+                    transform='translate(0,%s)' % (-font_size * 0.5),
+                    insert=geometry['node_txtp'][k], 
+                    font_family='monospace', 
+                    font_size=font_size, 
+                    text_anchor="middle"))))
+
+        return dict(head=head, defs=defs, nodes=node_layer, edges=edge_layer, labels=label_layer,
+                viewbox=list(viewbox), boxes=boxes, ends=ends)
+
 def maketestg():
     import networkx as nx
     import random
     random.seed(9999)
     g = nx.MultiDiGraph()
 
-    g.add_node(range(4))
-    g.add_node(range(4))
-    g.add_cycle(range(4))
+    g.add_nodes_from(range(4))
+    g.add_nodes_from(range(4))
+    nx.add_cycle(g, range(4))
     g.add_edge(5, 5)
     g.add_edge(5, 5)
     
-    for node, data in g.nodes_iter(data=True):
+    for node, data in g.nodes(data=True):
         data['value'] = node
 
-    for u, v, data in g.edges_iter(data=True):
+    for u, v, data in g.edges(data=True):
         data['value'] = u + v + int(random.random() * 3)
     pos = nx.shell_layout(g)
     return g, pos
@@ -504,6 +1003,33 @@ def test():
     red = SVGRenderer(EdgeSpacing=4.0) 
     stdout.write(red.draw(g, pos, nodeformatter=TestNodeFormatter, edgeformatter=TestEdgeFormatter))
 
+def testmarkers():
+    """ prints how much marker sharing saves on a directed graph, where every edge has a mid marker """
+    import networkx as nx
+    g = nx.MultiDiGraph(nx.gnm_random_graph(400, 1200, seed=9999, directed=True))
+    red = SVGRenderer()
+    svg = red.draw(g, nx.random_layout(g, seed=9999))
+    stats = red.stats
+    print('%d edges, %d markers used, %d defined' % (g.number_of_edges(), stats['marker_uses'], stats['markers']))
+    print('svg: %d bytes, %d bytes saved (%.0f%%)' % (len(svg), stats['bytes_saved'],
+            100. * stats['bytes_saved'] / (len(svg) + stats['bytes_saved'])))
+
+def benchmark(nodes=400, edges=1200, repeat=5):
+    """ times both backends on a random labeled graph """
+    import networkx as nx
+    import time
+    g = nx.MultiGraph(nx.gnm_random_graph(nodes, edges, seed=9999))
+    for node, data in g.nodes(data=True):
+        data['label'] = 'node %d\n(word, other word)\nsome description' % node
+    pos = nx.random_layout(g, seed=9999)
+    red = SVGRenderer(GlobalScale=nodes ** 0.6 * 300., Margin=nodes ** 0.6 * 15.)
+    for backend in ['svgwrite', 'string']:
+        start = time.time()
+        for i in range(repeat):
+            AutoID(1)
+            svg = red.draw(g, pos, backend=backend)
+        print('%-8s %7.1f ms %d bytes' % (backend, (time.time() - start) / repeat * 1000, len(svg)))
+
 def testmpl():
     from sys import stdout
     import networkx as nx
@@ -517,10 +1043,10 @@ def testmpl():
     ax.invert_yaxis()
     g, pos = maketestg()
     labels = {}
-    for node, data in g.nodes_iter(data=True):
+    for node, data in g.nodes(data=True):
         labels[node] = DefaultNodeFormatter(node, data)
     edge_labels = {}
-    for u, v, data in g.edges_iter(data=True):
+    for u, v, data in g.edges(data=True):
         edge_labels[u, v] = DefaultEdgeFormatter(u, v, data)
 
     #nx.draw_networkx_nodes(g, pos, ax=ax)
@@ -552,5 +1078,9 @@ if __name__ == "__main__":
     from sys import argv
     if len(argv) > 1 and argv[1] == 'mpl':
         testmpl()
+    elif len(argv) > 1 and argv[1] == 'markers':
+        testmarkers()
+    elif len(argv) > 1 and argv[1] == 'bench':
+        benchmark()
     else:
         test()
@@ -0,0 +1,90 @@
+MAX_ITEMS = 16 # items of a square before it is split
+MAX_DEPTH = 16
+
+
+class QuadTree:
+    """ items by bounding box (x0, y0, x1, y1), finds those in a rectangle without looking at the others.
+
+        An item is kept in the smallest square that contains it whole, so an item across
+        the middle of a square stays in that square. Items outside of the bounds are
+        kept in the root.
+    """
+
+    def __init__(self, bounds, depth=0):
+        self.bounds = bounds
+        self.depth = depth
+        self.items = [] # (box, item)
+        self.children = None
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def _child(self, box):
+        """ the child square box fits in, None if it is across several """
+        x0, y0, x1, y1 = self.bounds
+        xm = (x0 + x1) * 0.5
+        ym = (y0 + y1) * 0.5
+        if box[2] <= xm:
+            column = 0
+        elif box[0] >= xm:
+            column = 1
+        else:
+            return None
+        if box[3] <= ym:
+            row = 0
+        elif box[1] >= ym:
+            row = 1
+        else:
+            return None
+        return self.children[row * 2 + column]
+
+    def _split(self):
+        x0, y0, x1, y1 = self.bounds
+        xm = (x0 + x1) * 0.5
+        ym = (y0 + y1) * 0.5
+        self.children = [QuadTree(bounds, self.depth + 1) for bounds in
+                [(x0, y0, xm, ym), (xm, y0, x1, ym), (x0, ym, xm, y1), (xm, ym, x1, y1)]]
+        items = self.items
+        self.items = []
+        for box, item in items:
+            child = self._child(box)
+            if child is None:
+                self.items.append((box, item))
+            else:
+                child.items.append((box, item))
+                child.size += 1
+
+    def insert(self, box, item):
+        x0, y0, x1, y1 = self.bounds
+        square = self
+        if not (box[0] >= x0 and box[1] >= y0 and box[2] <= x1 and box[3] <= y1): # outside
+            square.items.append((box, item))
+            square.size += 1
+            return
+        while True:
+            square.size += 1
+            child = square._child(box) if square.children is not None else None
+            if child is None:
+                square.items.append((box, item))
+                if square.children is None and len(square.items) > MAX_ITEMS and square.depth < MAX_DEPTH:
+                    square._split()
+                return
+            square = child
+
+    def query(self, rect):
+        """ items whose box intersects rect """
+        x0, y0, x1, y1 = rect
+        found = []
+        squares = [self]
+        while squares:
+            square = squares.pop()
+            for box, item in square.items:
+                if box[0] <= x1 and box[2] >= x0 and box[1] <= y1 and box[3] >= y0:
+                    found.append(item)
+            if square.children is not None:
+                for child in square.children:
+                    bx0, by0, bx1, by1 = child.bounds
+                    if child.size and bx0 <= x1 and bx1 >= x0 and by0 <= y1 and by1 >= y0:
+                        squares.append(child)
+        return found
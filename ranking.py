@@ -0,0 +1,66 @@
+from bisect import bisect_left, insort
+
+
+class GroupRanking:
+    """ entries ranked by their number of words.
+
+        Entries sit in buckets of equal counts kept sorted by rank, so adding an entry
+        again with its new count only moves that entry, ordered() never sorts, and the
+        largest groups are found by only walking the highest buckets.
+    """
+
+    def __init__(self):
+        self.counts = {} # key -> number of words
+        self.ranks = {} # key -> order among equal counts, the registration order by default
+        self.buckets = {} # count -> sorted list of (rank, key)
+        self.counter = 0
+
+    def __contains__(self, key):
+        return key in self.counts
+
+    def __len__(self):
+        return len(self.counts)
+
+    def _insert(self, key):
+        insort(self.buckets.setdefault(self.counts[key], []), (self.ranks[key], key))
+
+    def _discard(self, key):
+        bucket = self.buckets[self.counts[key]]
+        del bucket[bisect_left(bucket, (self.ranks[key], key))]
+        if not bucket:
+            del self.buckets[self.counts[key]]
+
+    def add(self, key, count=0, rank=None):
+        """ rank orders equal counts, the registration order by default """
+        if key in self.counts:
+            self._discard(key)
+            self.counts[key] = count
+            if rank is not None:
+                self.ranks[key] = rank
+            self._insert(key)
+            return
+        self.ranks[key] = rank if rank is not None else self.counter
+        self.counter += 1
+        self.counts[key] = count
+        self._insert(key)
+
+    def remove(self, key):
+        self._discard(key)
+        del self.counts[key]
+        del self.ranks[key]
+
+    def ordered(self):
+        """ keys by increasing count, the last registered first among equal counts """
+        keys = []
+        for count in sorted(self.buckets):
+            keys += [key for rank, key in reversed(self.buckets[count])]
+        return keys
+
+    def top(self, k):
+        """ the k keys of highest count, highest first, same as reversing ordered() """
+        keys = []
+        for count in sorted(self.buckets, reverse=True):
+            if len(keys) >= k:
+                break
+            keys += [key for rank, key in self.buckets[count][:k - len(keys)]]
+        return keys
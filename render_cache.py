@@ -0,0 +1,97 @@
+import gzip
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from fileutil import atomic_write
+
+try:
+    import brotli
+except ImportError: # served in gzip only
+    brotli = None
+
+BROTLI_QUALITY = 9 # 11 takes seconds on a large graph, for a few percent
+
+
+def dictionary_key(data, graph_attrs=None): # data is the json file
+    """ hash of the normalized dictionary content and of the layout parameters """
+    normalized = json.dumps({'data': data, 'graph': graph_attrs or {}}, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+class RenderCache:
+    """ rendered svgs by dictionary_key, least recently used ones are evicted from memory.
+
+        With a directory, svgs are also written there as <key>.svg,
+        so that they survive a restart and memory evictions.
+    """
+
+    def __init__(self, max_entries=16, directory=None):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.svg')
+
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+        if self.directory is not None and os.path.exists(self._path(key)):
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                svg = f.read()
+            self._remember(key, svg)
+            self.hits += 1
+            return svg
+
+        self.misses += 1
+        return None
+
+    def put(self, key, svg):
+        self._remember(key, svg)
+        if self.directory is not None:
+            atomic_write(self._path(key), svg) # several workers may share the directory
+
+    def _remember(self, key, svg):
+        self.entries[key] = svg
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False) # least recently used
+
+
+class EncodedSVG:
+    """ an svg as served over http: a strong etag of its content and its compressed encodings,
+        each made once, by the first request asking for it
+    """
+
+    def __init__(self, svg, version):
+        self.version = version
+        self.encoded = {'identity': svg.encode('utf-8')}
+        self.etag = hashlib.sha256(self.encoded['identity']).hexdigest()[:32] # versions restart with the process
+        self.encodings = ['br', 'gzip', 'identity'] if brotli is not None else ['gzip', 'identity']
+
+    def negotiate(self, accept_encodings):
+        """ the best encoding of a request's werkzeug accept_encodings """
+        return accept_encodings.best_match(self.encodings, default='identity')
+
+    def encode(self, encoding):
+        if encoding not in self.encoded:
+            body = self.encoded['identity']
+            if encoding == 'gzip':
+                self.encoded[encoding] = gzip.compress(body, 9, mtime=0)
+            elif encoding == 'br':
+                self.encoded[encoding] = brotli.compress(body, quality=BROTLI_QUALITY)
+            else:
+                raise ValueError("Unknown encoding `%s`" % encoding)
+        return self.encoded[encoding]
+
+    def get_etag(self, encoding):
+        """ each encoding is another representation, with its own etag """
+        return self.etag if encoding == 'identity' else self.etag + '-' + encoding
@@ -0,0 +1,107 @@
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from graph_model import render
+
+
+class PoolClosedError(RuntimeError):
+    """ the pool was closed before anything was drawn """
+
+
+class RenderPool:
+    """ draws a GraphModel in a worker process, so that neither pages nor edits wait for a render.
+
+        request() returns at once with the last good svg and the model version it shows.
+        A single render runs at a time, on a snapshot of the model: requests made meanwhile
+        only mark it as outdated, and once it is done the latest state is drawn, skipping
+        every state in between. Renders chain anyway, each native layout starts from the
+        previous one, so more workers would not help.
+
+        Listeners are called after each render with the patch from the previous
+        drawing, see GraphModel.rendered, or only {'version', 'since': None} when
+        the new drawing cannot be patched in.
+    """
+
+    def __init__(self, model, lock=None):
+        self.model = model
+        self.lock = lock if lock is not None else threading.RLock() # the lock the model is edited under
+        self.done = threading.Condition(self.lock)
+        self.executor = ProcessPoolExecutor(max_workers=1)
+        self.running = None # future of the render in progress
+        self.outdated = False # requested while rendering
+        self.svg = None # last good render
+        self.version = None # model version it shows
+        self.error = None # of the last render, if it failed
+        self.stats = {'requests': 0, 'renders': 0, 'failed': 0}
+        self.closed = False # the executor takes no more renders
+        self.listeners = []
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    def request(self, wait=False):
+        """ asks for the current state of the model, returns the last good (svg, version).
+            Waits for the current state with wait, or when nothing was drawn yet.
+            Raises the error of the last render, or PoolClosedError, if there is nothing to return.
+        """
+        with self.lock:
+            self.stats['requests'] += 1
+            self._refresh()
+            version = self.model.version
+            if wait or self.svg is None:
+                while self.running is not None and (self.version is None or self.version < version):
+                    self.done.wait()
+                if self.svg is None and self.error is not None:
+                    raise self.error
+                if self.svg is None: # nothing running, nothing will be
+                    raise PoolClosedError('The render pool is closed, the graph was never drawn')
+            return self.svg, self.version
+
+    def refresh(self):
+        """ starts drawing the current state of the model if it is not, without waiting """
+        with self.lock:
+            self._refresh()
+
+    def _refresh(self): # called with the lock held
+        svg = self.model.cached()
+        if svg is not None:
+            self.svg, self.version = svg, self.model.version
+        elif self.closed:
+            return
+        elif self.running is None:
+            self._submit()
+        else:
+            self.outdated = True # drawn once the running render is done
+
+    def _submit(self): # called with the lock held
+        job = self.model.snapshot()
+        self.outdated = False
+        try:
+            self.running = self.executor.submit(render, job)
+        except RuntimeError: # shut down by the interpreter exiting
+            self.closed = True
+            return
+        self.stats['renders'] += 1
+        self.running.add_done_callback(lambda future: self._done(job, future))
+
+    def _done(self, job, future):
+        with self.lock:
+            self.running = None
+            try:
+                result = future.result()
+            except Exception as e: # keeping the last good svg
+                self.error = e
+                self.stats['failed'] += 1
+            else:
+                self.error = None
+                self.svg, patch = self.model.rendered(job, result)
+                self.version = job['version']
+                for listener in self.listeners:
+                    listener(patch if patch is not None else {'version': job['version'], 'since': None})
+            if self.outdated:
+                self._refresh()
+            self.done.notify_all()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+        self.executor.shutdown(wait=False, cancel_futures=True)
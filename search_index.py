@@ -0,0 +1,198 @@
+import unicodedata
+from bisect import bisect_left, insort
+from collections import Counter
+
+MIN_SHARED = 0.6 # part of the trigrams of a query a description must have to match it
+LIMIT = 20
+
+
+def _strip_accents(text):
+    text = unicodedata.normalize('NFKD', text)
+    return ''.join([char for char in text if not unicodedata.combining(char)])
+
+
+# accented latin letters, the ones of french, without going through unicodedata
+ACCENTS = dict((code, _strip_accents(chr(code))) for code in range(0xc0, 0x250)
+        if _strip_accents(chr(code)) != chr(code) and _strip_accents(chr(code)).isascii())
+
+
+def normalize(text):
+    """ lowercase and without accents, 'Été' and 'ete' are the same key """
+    text = text.lower()
+    if not text.isascii():
+        text = text.translate(ACCENTS)
+        if not text.isascii():
+            text = _strip_accents(text)
+    return text
+
+
+def trigrams(text):
+    """ trigrams of the words of text, padded so that word starts and ends count """
+    words = ['  ' + word + ' ' for word in normalize(text).split()]
+    return {word[i:i + 3] for word in words for i in range(len(word) - 2)}
+
+
+def _prefixed(keys, prefix, limit):
+    """ (key, word) of the sorted keys starting with prefix """
+    found = []
+    i = bisect_left(keys, (prefix,))
+    while i < len(keys) and len(found) < limit and keys[i][0].startswith(prefix):
+        found.append(keys[i])
+        i += 1
+    return found
+
+
+def _remove(keys, key):
+    i = bisect_left(keys, key)
+    if i < len(keys) and keys[i] == key:
+        del keys[i]
+
+
+class SearchIndex:
+    """ words found by their exact spelling, by prefix of the word or of a translation,
+        and by approximate words of their description.
+
+        Prefixes are looked up by bisection in sorted (key, word) lists, descriptions
+        through the words having each of their trigrams. Kept up to date by applying
+        the store's edits, subscribe apply to the store.
+    """
+
+    def __init__(self, data): # data is the json file
+        self.entries = {} # word -> (translations, description) it is indexed with
+        self.words = [] # sorted (normalized word, word)
+        self.translations = [] # sorted (normalized translation, word)
+        self.grams = {} # word -> trigrams of its description
+        self.postings = {} # trigram -> words having it in their description
+
+        for word, attrs in data.items():
+            self.entries[word] = (tuple(attrs['translations']), attrs['description'])
+            self.words.append((normalize(word), word))
+            for translation in attrs['translations']:
+                self.translations.append((normalize(translation), word))
+            self._add_grams(word, attrs['description'])
+        self.words.sort()
+        self.translations.sort()
+
+    def _add_grams(self, word, description):
+        grams = trigrams(description)
+        self.grams[word] = grams
+        for gram in grams:
+            self.postings.setdefault(gram, set()).add(word)
+
+    def _add(self, word, attrs):
+        self.entries[word] = (tuple(attrs['translations']), attrs['description'])
+        insort(self.words, (normalize(word), word))
+        for translation in attrs['translations']:
+            insort(self.translations, (normalize(translation), word))
+        self._add_grams(word, attrs['description'])
+
+    def _remove(self, word):
+        if word not in self.entries:
+            return
+        translations, description = self.entries.pop(word)
+        _remove(self.words, (normalize(word), word))
+        for translation in translations:
+            _remove(self.translations, (normalize(translation), word))
+        for gram in self.grams.pop(word):
+            self.postings[gram].discard(word)
+            if not self.postings[gram]:
+                del self.postings[gram]
+
+    def apply(self, op):
+        """ applies a store edit, see store.apply_op """
+        if op['op'] == 'add' or op['op'] == 'update':
+            self._remove(op['word'])
+            self._add(op['word'], op['attrs'])
+        elif op['op'] == 'rename':
+            self._remove(op['word'])
+            self._remove(op['new_word'])
+            self._add(op['new_word'], op['attrs'])
+        elif op['op'] == 'delete':
+            self._remove(op['word'])
+        else:
+            raise ValueError("Unknown operation `%s`" % op['op'])
+
+    # QUERIES
+
+    def exact(self, word):
+        return word if word in self.entries else None
+
+    def prefix(self, prefix, limit=LIMIT):
+        """ words starting with prefix """
+        return [word for key, word in _prefixed(self.words, normalize(prefix), limit)]
+
+    def translation_prefix(self, prefix, limit=LIMIT):
+        """ (translation, word) of the translations starting with prefix """
+        found = []
+        for key, word in _prefixed(self.translations, normalize(prefix), limit):
+            translation = next(t for t in self.entries[word][0] if normalize(t) == key)
+            found.append((translation, word))
+        return found
+
+    def fuzzy(self, query, limit=LIMIT):
+        """ (word, score) of the descriptions sharing enough trigrams with query, best first """
+        grams = trigrams(query)
+        if not grams:
+            return []
+        needed = max(1, int(len(grams) * MIN_SHARED + 0.999))
+        # a match misses at most len - needed trigrams, so it has two of the len - needed + 2
+        # rarest ones: the candidates are in two of their postings, the more common postings
+        # are only intersected with them
+        postings = sorted([self.postings.get(gram, set()) for gram in grams], key=len)
+        if needed == 1:
+            candidates = set().union(*postings)
+        else:
+            rare = postings[:len(grams) - needed + 2]
+            candidates = set()
+            for i, posting in enumerate(rare):
+                for other in rare[i + 1:]:
+                    candidates |= posting & other
+        counts = Counter()
+        for posting in postings:
+            counts.update(candidates & posting)
+
+        scores = [(word, count / len(grams)) for word, count in counts.items() if count >= needed]
+        return sorted(scores, key=lambda item: (-item[1], item[0]))[:limit]
+
+    def search(self, query, limit=LIMIT):
+        return {
+            'exact': self.exact(query),
+            'words': self.prefix(query, limit),
+            'translations': self.translation_prefix(query, limit),
+            'descriptions': self.fuzzy(query, limit),
+        }
+
+
+def benchmark(entries=100000, repeat=1000):
+    import random
+    import time
+
+    rng = random.Random(0)
+    letters = 'abcdefghijklmnopqrstuvwxyzéè'
+    def text(n):
+        return ' '.join(''.join(rng.choice(letters) for i in range(rng.randint(2, 9))) for j in range(n))
+    data = dict((text(1) + str(i), {'translations': text(2).split(), 'description': text(8), 'tags': [], 'type': 'simple noun'})
+            for i in range(entries))
+
+    t0 = time.perf_counter()
+    index = SearchIndex(data)
+    print('index of %d entries: %.2f s' % (len(data), time.perf_counter() - t0))
+
+    words = list(data)
+    for name, query in [('exact', lambda: index.exact(rng.choice(words))),
+            ('prefix', lambda: index.prefix(rng.choice(words)[:3])),
+            ('translation', lambda: index.translation_prefix(rng.choice(words)[:2])),
+            ('fuzzy', lambda: index.fuzzy(' '.join(data[rng.choice(words)]['description'].split()[2:4])))]:
+        t0 = time.perf_counter()
+        for i in range(repeat):
+            query()
+        print('%-12s %.3f ms' % (name, (time.perf_counter() - t0) / repeat * 1000))
+
+    t0 = time.perf_counter()
+    for i in range(repeat):
+        index.apply({'op': 'update', 'word': words[i], 'attrs': dict(data[words[i]], description=text(8))})
+    print('%-12s %.3f ms' % ('update', (time.perf_counter() - t0) / repeat * 1000))
+
+
+if __name__ == '__main__':
+    benchmark()
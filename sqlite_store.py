@@ -0,0 +1,269 @@
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from fileutil import atomic_write
+from store import StoreBusyError
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS words (
+    word TEXT PRIMARY KEY,
+    position INTEGER NOT NULL, -- order of the words in nyo.json
+    description TEXT NOT NULL,
+    type TEXT NOT NULL,
+    temporary_id INTEGER -- N of a /N word
+);
+CREATE INDEX IF NOT EXISTS words_position ON words (position);
+CREATE INDEX IF NOT EXISTS words_temporary_id ON words (temporary_id);
+
+CREATE TABLE IF NOT EXISTS tags (
+    word TEXT NOT NULL REFERENCES words (word) ON DELETE CASCADE,
+    rank INTEGER NOT NULL,
+    tag TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tags_word_rank ON tags (word, rank);
+
+CREATE TABLE IF NOT EXISTS translations (
+    word TEXT NOT NULL REFERENCES words (word) ON DELETE CASCADE,
+    rank INTEGER NOT NULL,
+    translation TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS translations_word_rank ON translations (word, rank);
+
+-- lookup indexes of earlier databases, lookups are answered from memory
+DROP INDEX IF EXISTS tags_tag;
+DROP INDEX IF EXISTS tags_word;
+DROP INDEX IF EXISTS translations_translation;
+DROP INDEX IF EXISTS translations_word;
+DROP TABLE IF EXISTS components;
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS versions ( -- kept for deleted words too
+    word TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS ops ( -- recent edits, read by the other worker processes
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    op TEXT NOT NULL
+);
+"""
+
+OPS_KEPT = 10000 # workers further behind than that reload everything
+BUSY_TIMEOUT = 30. # seconds a statement, or starting a transaction, waits for the transaction of another process
+
+
+def _temporary_id(word):
+    if word[0] == '/' and word[1:].isdigit():
+        return int(word[1:])
+    return None
+
+
+class SQLiteBackend:
+    """ dictionary entries in SQLite tables, a storage backend for store.DictionaryStore.
+
+        Tags and translations have tables of their own, indexed by word only: the store
+        answers lookups by translation, tag or component from memory (the edge indexes of
+        the graph model), the tables are only read when loading. The highest temporary id
+        seeds the counter from an index. Applied edits are also kept in the ops table for
+        the other worker processes.
+    """
+
+    def __init__(self, path='nyo.db'):
+        self.path = path
+        self.lock = threading.RLock() # the connection is shared by the flush thread and the request threads
+        self.connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False, isolation_level=None) # transactions are explicit
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.executescript(SCHEMA)
+        self._depth = 0
+        self.seq = 0 # last edit of the ops table this process has
+        self.generation = 0 # bumped by imports, which replace everything
+        with self.transaction(): # seeding the temporary id counter
+            self.connection.execute("INSERT OR IGNORE INTO meta (key, value) "
+                    "SELECT 'temporary_id', COALESCE(MAX(temporary_id), 0) FROM words")
+            self.connection.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', 0)")
+
+    @contextmanager
+    def transaction(self):
+        """ write transaction, excludes every other process until it ends. Nested ones join the outer one. """
+        with self.lock:
+            if self._depth == 0:
+                self._begin()
+            self._depth += 1
+            try:
+                yield
+            except BaseException:
+                self._depth -= 1
+                if self._depth == 0:
+                    self.connection.execute('ROLLBACK')
+                raise
+            self._depth -= 1
+            if self._depth == 0:
+                self.connection.execute('COMMIT')
+
+    def _begin(self):
+        # retried when sqlite gives up early, but never past BUSY_TIMEOUT in all: the store lock is held meanwhile
+        deadline = time.monotonic() + BUSY_TIMEOUT
+        delay = 0.05
+        try:
+            while True:
+                try:
+                    self.connection.execute('BEGIN IMMEDIATE')
+                    return
+                except sqlite3.OperationalError as e: # database is locked, other workers hold it
+                    if 'locked' not in str(e) and 'busy' not in str(e):
+                        raise
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    raise StoreBusyError("`%s` was locked by another process for more than %g s" % (self.path, BUSY_TIMEOUT))
+                time.sleep(min(delay, left))
+                delay *= 2
+                self.connection.execute('PRAGMA busy_timeout = %d' % max(1, (deadline - time.monotonic()) * 1000))
+        finally:
+            self.connection.execute('PRAGMA busy_timeout = %d' % (BUSY_TIMEOUT * 1000))
+
+    def _meta(self, key):
+        return self.connection.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()[0]
+
+    # WRITING
+
+    def _put(self, word, attrs):
+        cursor = self.connection.cursor()
+        row = cursor.execute('SELECT position FROM words WHERE word = ?', (word,)).fetchone()
+        if row is None: # new words go last, like in a dict
+            position = cursor.execute('SELECT COALESCE(MAX(position) + 1, 0) FROM words').fetchone()[0]
+        else:
+            position = row[0]
+            self._delete(word)
+
+        cursor.execute('INSERT INTO words (word, position, description, type, temporary_id) VALUES (?, ?, ?, ?, ?)',
+                (word, position, attrs['description'], attrs['type'], _temporary_id(word)))
+        cursor.executemany('INSERT INTO tags (word, rank, tag) VALUES (?, ?, ?)',
+                [(word, rank, tag) for rank, tag in enumerate(attrs['tags'])])
+        cursor.executemany('INSERT INTO translations (word, rank, translation) VALUES (?, ?, ?)',
+                [(word, rank, translation) for rank, translation in enumerate(attrs['translations'])])
+
+    def _delete(self, word):
+        self.connection.execute('DELETE FROM words WHERE word = ?', (word,)) # cascades
+
+    def append(self, ops):
+        """ applies a batch of store edits in one transaction """
+        with self.transaction():
+            for op in ops:
+                if op['op'] == 'add' or op['op'] == 'update':
+                    self._put(op['word'], op['attrs'])
+                elif op['op'] == 'rename':
+                    self._put(op['new_word'], op['attrs'])
+                    if op['word'] != op['new_word']:
+                        self._delete(op['word'])
+                elif op['op'] == 'delete':
+                    self._delete(op['word'])
+                else:
+                    raise ValueError("Unknown operation `%s`" % op['op'])
+                if 'version' in op:
+                    for word in set([op['word'], op.get('new_word', op['word'])]):
+                        self.connection.execute('INSERT OR REPLACE INTO versions (word, version) VALUES (?, ?)', (word, op['version']))
+
+            self.connection.executemany('INSERT INTO ops (op) VALUES (?)', [(json.dumps(op, ensure_ascii=False),) for op in ops])
+            self.seq = self.connection.execute('SELECT MAX(seq) FROM ops').fetchone()[0]
+            self.connection.execute('DELETE FROM ops WHERE seq <= ?', (self.seq - OPS_KEPT,))
+
+    def import_data(self, data): # data is the json file
+        """ replaces every entry by the ones of data """
+        with self.transaction():
+            self.connection.execute('DELETE FROM words')
+            for word, attrs in data.items():
+                self._put(word, attrs)
+            self.connection.execute("UPDATE meta SET value = MAX(value, (SELECT COALESCE(MAX(temporary_id), 0) FROM words)) "
+                    "WHERE key = 'temporary_id'")
+            self.connection.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+
+    # READING
+
+    def load(self):
+        with self.transaction():
+            cursor = self.connection.cursor()
+            self.seq = cursor.execute('SELECT COALESCE(MAX(seq), 0) FROM ops').fetchone()[0]
+            self.generation = self._meta('generation')
+            versions = dict(cursor.execute('SELECT word, version FROM versions'))
+            data = {}
+            for word, description, type in cursor.execute('SELECT word, description, type FROM words ORDER BY position'):
+                data[word] = {'description': description, 'tags': [], 'translations': [], 'type': type}
+            for word, tag in cursor.execute('SELECT word, tag FROM tags ORDER BY word, rank'):
+                data[word]['tags'].append(tag)
+            for word, translation in cursor.execute('SELECT word, translation FROM translations ORDER BY word, rank'):
+                data[word]['translations'].append(translation)
+        return data, versions
+
+    def changes(self):
+        """ edits other processes made since this one last looked, None if it must reload everything """
+        with self.transaction():
+            if self._meta('generation') != self.generation:
+                return None
+            oldest = self.connection.execute('SELECT MIN(seq) FROM ops').fetchone()[0]
+            if oldest is not None and oldest > self.seq + 1: # pruned past us
+                return None
+            ops = []
+            for seq, op in self.connection.execute('SELECT seq, op FROM ops WHERE seq > ? ORDER BY seq', (self.seq,)):
+                ops.append(json.loads(op))
+                self.seq = seq
+        return ops
+
+    def allocate_temporary_ids(self, count):
+        """ reserves count consecutive temporary ids, returns the first one """
+        with self.transaction(): # other processes wait
+            self.connection.execute("UPDATE meta SET value = value + ? WHERE key = 'temporary_id'", (count,))
+            last = self.connection.execute("SELECT value FROM meta WHERE key = 'temporary_id'").fetchone()[0]
+        return last - count + 1
+
+    # STORE INTERFACE
+    # edits are already durable once appended, there is nothing to compact
+
+    def needs_compaction(self, on_close=False):
+        return False
+
+    def snapshot(self, data, versions):
+        return None
+
+    def compact(self, snapshot):
+        pass
+
+    def get_stats(self):
+        with self.lock:
+            return {'words': self.connection.execute('SELECT COUNT(*) FROM words').fetchone()[0]}
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def import_json(json_path, db_path):
+    with open(json_path, 'r') as f:
+        data = json.load(f)
+    backend = SQLiteBackend(db_path)
+    backend.import_data(data)
+    backend.close()
+
+
+def export_json(db_path, json_path):
+    backend = SQLiteBackend(db_path)
+    data, versions = backend.load()
+    atomic_write(json_path, json.dumps(data, indent=4))
+    backend.close()
+
+
+if __name__ == '__main__':
+    from sys import argv
+    # python sqlite_store.py import nyo.json nyo.db
+    # python sqlite_store.py export nyo.db nyo.json
+    if len(argv) == 4 and argv[1] == 'import':
+        import_json(argv[2], argv[3])
+    elif len(argv) == 4 and argv[1] == 'export':
+        export_json(argv[2], argv[3])
+    else:
+        print('usage: python sqlite_store.py import|export <from> <to>')
@@ -0,0 +1,434 @@
+import atexit
+import json
+import os
+import threading
+import time
+import traceback
+from fileutil import atomic_write, FileLock
+from journal import Journal
+
+# edits are plain dicts, the same ones are applied to the data, sent to listeners and written to disk
+# {'op': 'add', 'word': ..., 'attrs': {...}}
+# {'op': 'update', 'word': ..., 'attrs': {...}}
+# {'op': 'rename', 'word': ..., 'new_word': ..., 'attrs': {...}} # same as data[new_word] = attrs then data.pop(word)
+# {'op': 'delete', 'word': ...}
+# once applied by the store they also hold 'version', the new version of the entries they touched
+
+
+def apply_op(data, op):
+    if op['op'] == 'add' or op['op'] == 'update':
+        data[op['word']] = op['attrs']
+    elif op['op'] == 'rename':
+        data[op['new_word']] = op['attrs']
+        if op['word'] != op['new_word']:
+            data.pop(op['word'], None)
+    elif op['op'] == 'delete':
+        data.pop(op['word'], None)
+    else:
+        raise ValueError("Unknown operation `%s`" % op['op'])
+
+
+def apply_version(versions, op):
+    if 'version' not in op: # journaled before entries had versions
+        return
+    versions[op['word']] = op['version']
+    if op['op'] == 'rename':
+        versions[op['new_word']] = op['version']
+
+
+def diff_ops(data, new_data):
+    """ ops turning data into new_data, used when another process rewrote the snapshot """
+    ops = [{'op': 'delete', 'word': word} for word in data if word not in new_data]
+    for word, attrs in new_data.items():
+        if word not in data:
+            ops.append({'op': 'add', 'word': word, 'attrs': attrs})
+        elif attrs != data[word]:
+            ops.append({'op': 'update', 'word': word, 'attrs': attrs})
+    return ops
+
+
+class ConflictError(Exception):
+    """ the entry changed since the version an edit was based on """
+
+    def __init__(self, word, expected, current):
+        super().__init__("`%s` is at version %s, the edit was based on version %s" % (word, current, expected))
+        self.word = word
+        self.expected = expected
+        self.current = current
+
+
+class StoreBusyError(Exception):
+    """ another process kept the dictionary locked for too long, the edit was not made """
+
+
+class JSONBackend:
+    """ nyo.json snapshot plus an append-only journal of the edits made since.
+
+        Loading replays the journal over the snapshot, and once the journal holds
+        more than compact_threshold edits it is folded back into a fresh snapshot.
+        Entry versions are saved next to the snapshot when compacting.
+    """
+
+    def __init__(self, path='nyo.json', compact_threshold=500):
+        self.path = path
+        self.compact_threshold = compact_threshold
+        base = os.path.splitext(path)[0]
+        self.journal = Journal(base + '.journal')
+        self.journal_length = 0
+        self.journal_offset = 0 # how far this process has read the journal
+        self.versions_path = base + '.versions'
+        self.counter_path = base + '.counter' # last temporary id handed out
+        self.counter_lock = FileLock(self.counter_path)
+        self.file_lock = FileLock(path) # held by a process writing the snapshot or the journal
+        self.snapshot_id = None # identifies the snapshot file this process loaded
+
+    def _snapshot_id(self):
+        st = os.stat(self.path)
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def load(self):
+        with self.file_lock:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            self.snapshot_id = self._snapshot_id()
+            versions = {}
+            if os.path.exists(self.versions_path):
+                with open(self.versions_path, 'r') as f:
+                    versions = json.load(f)
+
+            # edits since the snapshot, replaying them is harmless if the snapshot already has them
+            ops, self.journal_offset = self.journal.read()
+            for op in ops:
+                apply_op(data, op)
+                apply_version(versions, op)
+            self.journal_length = len(ops)
+
+        with self.counter_lock: # seeding the counter, the only scan of the ids
+            if not os.path.exists(self.counter_path):
+                atomic_write(self.counter_path, str(self.max_temporary_id(data)))
+        return data, versions
+
+    def transaction(self):
+        """ held while an edit is checked and written, excludes every other process """
+        return self.file_lock
+
+    def changes(self):
+        """ ops other processes journaled since this one last looked, None if the snapshot was rewritten """
+        if self._snapshot_id() != self.snapshot_id:
+            return None
+        ops, self.journal_offset = self.journal.read(self.journal_offset)
+        self.journal_length += len(ops)
+        return ops
+
+    def append(self, ops):
+        self.journal_offset = self.journal.append(ops)
+        self.journal_length += len(ops)
+
+    def needs_compaction(self, on_close=False):
+        if on_close:
+            return self.journal_length > 0
+        return self.journal_length > self.compact_threshold
+
+    def snapshot(self, data, versions): # called with the store locked
+        return json.dumps(data, indent=4), json.dumps(versions)
+
+    def compact(self, snapshot):
+        data_text, versions_text = snapshot
+        with self.file_lock:
+            atomic_write(self.versions_path, versions_text)
+            atomic_write(self.path, data_text)
+            self.journal.truncate() # a crash before this only means replaying edits the snapshot has
+            self.snapshot_id = self._snapshot_id()
+            self.journal_offset = 0
+            self.journal_length = 0
+
+    def max_temporary_id(self, data):
+        ids = [int(word[1:]) for word in data if word[0] == '/'] # following a /, it's all digits
+        return max(ids) if ids else 0
+
+    def allocate_temporary_ids(self, count):
+        """ reserves count consecutive temporary ids for this process, returns the first one """
+        with self.counter_lock: # other workers wait here
+            with open(self.counter_path, 'r') as f:
+                last = int(f.read())
+            atomic_write(self.counter_path, str(last + count))
+        return last + 1
+
+    def get_stats(self):
+        return {'journal_length': self.journal_length}
+
+    def close(self):
+        pass
+
+
+class DictionaryStore:
+    """ the dictionary, loaded once and served from memory.
+
+        Edits are applied in memory right away and handed to the storage backend
+        later by a background thread, in batches of every edit made in the meantime.
+        The backend is a JSONBackend or a sqlite_store.SQLiteBackend.
+
+        Every entry has a version, bumped by each edit touching it. An edit given
+        an expected_version is refused with a ConflictError if the entry moved on.
+
+        A shared store is one several worker processes edit at once: each edit
+        takes the backend's lock, first applies what the other workers wrote,
+        then is checked and written before the lock is released.
+    """
+
+    def __init__(self, backend, flush_delay=0.5, shared=False):
+        self.backend = backend
+        self.flush_delay = flush_delay # seconds edits are left to pile up before a flush
+        self.shared = shared
+        self.data, self.versions = backend.load()
+
+        self.version = 0 # number of edits applied since loading
+        self.listeners = [] # called with each op once applied
+        self.lock = threading.RLock()
+
+        self.pending = [] # (op, time it was applied) not yet on disk
+        self.stats = {
+            'flushes': 0,
+            'ops_flushed': 0,
+            'last_flush_seconds': 0.0, # time spent writing
+            'max_flush_seconds': 0.0,
+            'last_op_latency_seconds': 0.0, # time an edit waited before being on disk
+            'max_op_latency_seconds': 0.0,
+            'compactions': 0,
+            'last_compaction_seconds': 0.0,
+            'conflicts': 0,
+            'listener_errors': 0, # edits a listener failed on, see _apply
+        }
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._flush_lock = threading.Lock()
+        if not shared: # shared stores write synchronously
+            self._thread = threading.Thread(target=self._run, name='nyo-store-flush', daemon=True)
+            self._thread.start()
+
+    # READS
+
+    def __contains__(self, word):
+        return word in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, word):
+        """ copy of the attributes of word, None if it is not in the dictionary """
+        attrs = self.data.get(word)
+        if attrs is None:
+            return None
+        return json.loads(json.dumps(attrs))
+
+    def get_version(self, word):
+        return self.versions.get(word, 0)
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, queue_depth=len(self.pending), version=self.version, **self.backend.get_stats())
+
+    def new_temporary_ids(self, count=1):
+        """ count unused /N ids, never handed out twice even by different worker processes """
+        ids = []
+        while len(ids) < count:
+            missing = count - len(ids)
+            first = self.backend.allocate_temporary_ids(missing)
+            # skipping ids that were typed in by hand
+            ids += ['/' + str(n) for n in range(first, first + missing) if '/' + str(n) not in self.data]
+        return ids
+
+    def new_temporary_id(self):
+        return self.new_temporary_ids(1)[0]
+
+    # WRITES
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    def _apply(self, op): # called with the store locked
+        apply_op(self.data, op)
+        apply_version(self.versions, op)
+        self.version += 1
+        for listener in self.listeners:
+            try:
+                listener(op)
+            except Exception: # the edit is applied and still written, the other listeners still get it
+                self.stats['listener_errors'] += 1
+                traceback.print_exc()
+
+    def _prepare(self, op, expected_version): # called with the store locked
+        """ checks op against the current versions and gives it its version """
+        word = op['word']
+        new_word = op['new_word'] if op['op'] == 'rename' else word if op['op'] != 'delete' else None
+        if new_word is not None and (not isinstance(new_word, str) or new_word.strip() == ''):
+            raise ValueError("Invalid word `%s`" % new_word)
+        if op['op'] == 'add' and word in self.data:
+            raise ConflictError(word, None, self.get_version(word))
+        if expected_version is not None and self.get_version(word) != expected_version:
+            self.stats['conflicts'] += 1
+            raise ConflictError(word, expected_version, self.get_version(word))
+        op['version'] = self.get_version(word) + 1
+        if op['op'] == 'rename':
+            op['version'] = max(op['version'], self.get_version(op['new_word']) + 1)
+
+    def refresh(self):
+        """ applies the edits other worker processes made, only shared stores need it """
+        if not self.shared:
+            return
+        with self.lock, self.backend.transaction():
+            self._catch_up()
+
+    def _catch_up(self): # called with the store and the backend locked
+        ops = self.backend.changes()
+        if ops is None: # snapshot rewritten, diffing against it
+            data, versions = self.backend.load()
+            for op in diff_ops(self.data, data):
+                op['version'] = versions.get(op['word'], 0)
+                self._apply(op)
+            self.versions = versions
+            return
+        for op in ops:
+            self._apply(op)
+
+    def apply(self, op, expected_version=None):
+        """ applies an edit, expected_version being the version of op['word'] it was based on.
+            Returns the new version of the entry.
+        """
+        with self.lock:
+            if self.shared:
+                with self.backend.transaction():
+                    self._catch_up()
+                    self._prepare(op, expected_version)
+                    self._apply(op)
+                    self.backend.append([op]) # other workers see it once the lock is released
+            else:
+                self._prepare(op, expected_version)
+                self._apply(op)
+                self.pending.append((op, time.perf_counter()))
+
+        if not self.shared:
+            self._wakeup.set()
+        elif self.backend.needs_compaction():
+            self.compact()
+        return op['version']
+
+    def apply_batch(self, ops):
+        """ applies edits in a single transaction, none of them if one is refused.
+            Each word can only be touched by one of the edits. Returns their new versions.
+        """
+        words = [word for op in ops for word in set([op['word'], op.get('new_word', op['word'])])]
+        if len(set(words)) != len(words):
+            raise ValueError("A batch can only touch a word once")
+        with self.lock:
+            if self.shared:
+                with self.backend.transaction():
+                    self._catch_up()
+                    for op in ops: # checking them all before applying any
+                        self._prepare(op, None)
+                    for op in ops:
+                        self._apply(op)
+                    self.backend.append(ops)
+            else:
+                for op in ops:
+                    self._prepare(op, None)
+                for op in ops:
+                    self._apply(op)
+                applied = time.perf_counter()
+                self.pending += [(op, applied) for op in ops]
+
+        if not self.shared:
+            self._wakeup.set()
+        elif self.backend.needs_compaction():
+            self.compact()
+        return [op['version'] for op in ops]
+
+    def add(self, word, attrs):
+        return self.apply({'op': 'add', 'word': word, 'attrs': attrs})
+
+    def update(self, word, attrs, expected_version=None):
+        return self.apply({'op': 'update', 'word': word, 'attrs': attrs}, expected_version)
+
+    def rename(self, word, new_word, attrs, expected_version=None):
+        return self.apply({'op': 'rename', 'word': word, 'new_word': new_word, 'attrs': attrs}, expected_version)
+
+    def delete(self, word, expected_version=None):
+        return self.apply({'op': 'delete', 'word': word}, expected_version)
+
+    # FLUSHING
+
+    def flush(self):
+        """ hands every pending edit to the backend """
+        with self._flush_lock:
+            with self.lock:
+                if not self.pending:
+                    return
+                batch = self.pending
+                self.pending = []
+
+            start = time.perf_counter()
+            self.backend.append([op for op, applied in batch])
+            end = time.perf_counter()
+
+            with self.lock:
+                stats = self.stats
+                stats['flushes'] += 1
+                stats['ops_flushed'] += len(batch)
+                stats['last_flush_seconds'] = end - start
+                stats['max_flush_seconds'] = max(stats['max_flush_seconds'], end - start)
+                stats['last_op_latency_seconds'] = end - batch[0][1] # oldest edit of the batch
+                stats['max_op_latency_seconds'] = max(stats['max_op_latency_seconds'], end - batch[0][1])
+
+        if self.backend.needs_compaction():
+            self.compact()
+
+    def compact(self):
+        """ folds the backend's journal into a fresh snapshot """
+        with self._flush_lock:
+            start = time.perf_counter()
+            if self.shared:
+                with self.lock, self.backend.transaction(): # the snapshot must hold every worker's edits
+                    self._catch_up()
+                    self.backend.compact(self.backend.snapshot(self.data, self.versions))
+            else:
+                with self.lock:
+                    snapshot = self.backend.snapshot(self.data, self.versions)
+                    self.pending = [] # already in the snapshot
+                self.backend.compact(snapshot)
+            with self.lock:
+                self.stats['compactions'] += 1
+                self.stats['last_compaction_seconds'] = time.perf_counter() - start
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            time.sleep(self.flush_delay) # lets edits of the same burst join the batch
+            self.flush()
+
+    def close(self):
+        self._closed = True
+        self._wakeup.set()
+        self.flush()
+        if self.backend.needs_compaction(on_close=True):
+            self.compact() # leaves an up to date nyo.json behind
+        self.backend.close()
+
+
+_stores = {}
+
+def get_store(path='nyo.json', shared=None):
+    """ process-wide store of a dictionary file, .db/.sqlite files use the SQLite backend.
+        The store is shared between worker processes if NYO_SHARED is set.
+    """
+    if shared is None:
+        shared = os.environ.get('NYO_SHARED', '') not in ('', '0')
+    if path not in _stores:
+        if path.endswith(('.db', '.sqlite', '.sqlite3')):
+            from sqlite_store import SQLiteBackend
+            backend = SQLiteBackend(path)
+        else:
+            backend = JSONBackend(path)
+        _stores[path] = DictionaryStore(backend, shared=shared)
+        atexit.register(_stores[path].close)
+    return _stores[path]
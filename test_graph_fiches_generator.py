@@ -0,0 +1,35 @@
+import json
+import pytest
+import graph_fiches_generator
+from graph_fiches_generator import iter_entries
+
+DOCUMENT = {
+    'before': [1.5, -2e-3, {'a': "b\"c"}, None],
+    'entries': [
+        {'code': 'sen', 'type': 'class', 'label': "lé \\ \"x\"", 'words': [{'code': 'ko sen', 'label': ''}]},
+        12.25,
+        -0.5e10,
+        1e5,
+        3,
+        True,
+        None,
+        "1.",
+        [1.0, [2.5e-1]],
+    ],
+    'groups': {'a': 7.75},
+}
+
+
+@pytest.mark.parametrize('indent', [None, 4])
+def test_iter_entries_split_anywhere(tmp_path, monkeypatch, indent):
+    path = tmp_path / 'groups.json'
+    text = json.dumps(DOCUMENT, indent=indent, ensure_ascii=False)
+    path.write_text(text, encoding='utf-8')
+    for chunk_size in range(1, len(text) + 1): # the first chunk ends at every offset
+        monkeypatch.setattr(graph_fiches_generator, 'CHUNK_SIZE', chunk_size)
+        assert list(iter_entries(str(path))) == DOCUMENT['entries'], chunk_size
+
+
+def test_iter_entries_groups_json():
+    with open('groups.json', 'r', encoding='utf-8') as f:
+        assert list(iter_entries('groups.json')) == json.load(f)['entries']
@@ -0,0 +1,106 @@
+import json
+import pytest
+from grapher_fiches import FicheIndex
+from labels import get_label
+
+
+def reference_groups(data):
+    """ groups.json as the first get_graph wrote it, going through the json file once """
+    words = []
+    classes = {}
+    colors = {}
+    groups = {}
+    for word, attrs in data.items():
+        if attrs['type'] in ('class', 'special', 'pronoun', 'state'):
+            classes[word] = {'label': get_label(word, attrs), 'words': []}
+        if attrs['type'] in ('color', 'numeral'):
+            colors[word] = {'label': get_label(word, attrs), 'words': []}
+
+    for word, attrs in data.items():
+        if attrs['type'] not in ('simple noun', 'compound'):
+            continue
+        word_instance = {'code': word, 'label': get_label(word, attrs)}
+        if attrs['type'] == 'simple noun':
+            for component in word.split(' '):
+                if component in classes:
+                    classes[component]['words'].append(word_instance)
+                else:
+                    colors.setdefault(component, {'label': "", 'words': []})['words'].append(word_instance)
+        else:
+            classes.setdefault(word.split(' ')[-1], {'label': "", 'words': []})['words'].append(word_instance)
+        for key in [tag for tag in attrs['tags'] if tag != 'p'] + attrs['translations']:
+            groups.setdefault(key, []).append(word_instance)
+
+    for dict_, type_name in [(classes, 'class'), (colors, 'color')]:
+        for word, attrs in dict_.items():
+            i = 0
+            while i < len(words) and len(attrs['words']) > len(words[i]['words']):
+                i += 1
+            words.insert(i, {'code': word, 'type': type_name, 'label': attrs['label'], 'words': attrs['words']})
+    return {'entries': words, 'groups': dict((key, values) for key, values in groups.items() if len(values) > 1)}
+
+
+def entry(type, tags=(), translations=()):
+    return {'description': '', 'tags': list(tags), 'translations': list(translations), 'type': type}
+
+
+ORDERED = {
+    'sen na': entry('simple noun', translations=['x']),
+    'ko sen': entry('compound', translations=['x']),
+    'sen lo': entry('simple noun'),
+    'lo': entry('color'),
+    'na lo': entry('compound'),
+    'ko lo': entry('simple noun', tags=['t']),
+    'lo lo': entry('simple noun', tags=['t']),
+    'na': entry('class'),
+}
+
+
+def test_ordered_placement():
+    entries = FicheIndex(ORDERED).groups_json()['entries']
+    boxes = dict(((box['code'], box['type']), [word['code'] for word in box['words']]) for box in entries)
+    assert boxes[('sen', 'color')] == ['sen na'] # seen before the class existed
+    assert boxes[('sen', 'class')] == ['ko sen', 'sen lo']
+    assert boxes[('lo', 'color')] == ['sen lo']
+    assert boxes[('lo', 'class')] == ['na lo', 'ko lo', 'lo lo', 'lo lo']
+    assert FicheIndex(ORDERED).groups_json() == reference_groups(ORDERED)
+
+
+@pytest.mark.parametrize('data', [ORDERED, 'nyo.json'])
+def test_same_as_reference(data):
+    if isinstance(data, str):
+        with open(data, 'r') as f:
+            data = json.load(f)
+    assert FicheIndex(data).groups_json() == reference_groups(data)
+
+
+def test_edits_same_as_reference():
+    with open('nyo.json', 'r') as f:
+        data = json.load(f)
+    index = FicheIndex({})
+    current = {}
+    for word, attrs in data.items(): # built one edit at a time, laid out along the way
+        index.apply({'op': 'add', 'word': word, 'attrs': attrs})
+        current[word] = attrs
+        if len(current) % 50 == 0:
+            assert index.groups_json() == reference_groups(current)
+    assert index.groups_json() == reference_groups(current)
+
+    edits = [
+        {'op': 'add', 'word': 'sen na', 'attrs': entry('simple noun')},
+        {'op': 'add', 'word': 'ko sen', 'attrs': entry('compound')},
+        {'op': 'add', 'word': 'sen lo', 'attrs': entry('simple noun')},
+        {'op': 'delete', 'word': 'ko sen'}, # the nouns after it go back to the color
+        {'op': 'rename', 'word': 'sen na', 'new_word': 'lo sen', 'attrs': entry('compound')},
+        {'op': 'update', 'word': 'sen lo', 'attrs': entry('simple noun', translations=['x'])},
+    ]
+    for op in edits:
+        index.apply(op)
+        if op['op'] == 'rename':
+            current[op['new_word']] = op['attrs']
+            current.pop(op['word'])
+        elif op['op'] == 'delete':
+            current.pop(op['word'])
+        else:
+            current[op['word']] = op['attrs']
+        assert index.groups_json() == reference_groups(current)